@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Bus cost benchmark for the display classes
+#
+# Runs the display classes against the fake SMBus / GPIO backends from
+# fake_hardware and reports the transactions, bytes and modelled wall
+# time of display, displayLine, updateScroll and clear. The HD44780 model
+# checks that the display shows what was written.
+#
+# Usage: python bench_lcd.py [--json FILE] [--baseline FILE] [--tolerance 0.1]
+#
+# With --baseline the modelled time per call is compared against a
+# previous --json run and the exit code is 1 if any case got slower.
+#
+
+import sys
+import json
+import argparse
+
+import fake_hardware
+
+hardware = fake_hardware.install()
+
+import i2c_lib
+import i2c_lcd_driver
+import lcd_core
+import lcd_i2c_class
+import lcd_class
+import bus_scheduler
+from lcd_scroll import scrollOffsets
+
+hardware.useModelClock( i2c_lib, i2c_lcd_driver, lcd_core, lcd_class, bus_scheduler )
+
+ARTIST = 'Buena Vista Social Club'
+TITLE = 'Chan Chan - Remastered 1997 Version'
+TEXTS = [ 'Hello World 0001', 'Another line 002' ]
+
+# Run function calls times and return the cost per call
+def measure( function, calls ):
+	hardware.reset()
+	start = hardware.clock.now
+	for i in range( calls ):
+		function( i )
+	stats = hardware.stats()
+	result = { key: value / calls for key, value in stats.items() }
+	result[ 'time_ms' ] = ( hardware.clock.now - start ) / calls * 1000
+	return result
+
+def i2cDisplay():
+	return hardware.pcf8574( i2c_lcd_driver.ADDRESS ).display
+
+def gpioDisplay():
+	return hardware.gpio.display
+
+# Benchmark cases of one display class
+def cases( lcd, display ):
+	results = {}
+
+	def check( expected, row=0 ):
+		return display().screen( lcd.width )[ row ].rstrip() == expected.rstrip()
+
+	lcd.clear()
+	results[ 'display (changed)' ] = measure( lambda i: lcd.display( 1, TEXTS[ i % 2 ] ), 20 )
+	results[ 'display (changed)' ][ 'ok' ] = check( TEXTS[ 1 ] )
+	results[ 'display (unchanged)' ] = measure( lambda i: lcd.display( 1, TEXTS[ 1 ] ), 20 )
+	results[ 'display (unchanged)' ][ 'ok' ] = check( TEXTS[ 1 ] )
+	results[ 'displayLine' ] = measure( lambda i: lcd.displayLine( 1, TEXTS[ i % 2 ] ), 20 )
+	results[ 'displayLine' ][ 'ok' ] = check( TEXTS[ 1 ] )
+
+	lcd.setLine( 1, 'Short' )
+	lcd.setLine( 2, 'Static' )
+	results[ 'updateScroll (static)' ] = measure( lambda i: lcd.updateScroll(), 20 )
+	results[ 'updateScroll (static)' ][ 'ok' ] = check( 'Short' )
+
+	for hardware_scroll in ( False, True ):
+		lcd.setHardwareScroll( hardware_scroll )
+		lcd.setLine( 1, ARTIST )
+		lcd.setLine( 2, TITLE )
+		# one full cycle of the title brings it back to its start
+		ticks = len( scrollOffsets( len( TITLE ), lcd.width, lcd.scroll_pause ) )
+		name = 'updateScroll (scrolling{})'.format( ', hardware' if hardware_scroll else '' )
+		results[ name ] = measure( lambda i: lcd.updateScroll(), ticks )
+		results[ name ][ 'ok' ] = check( TITLE[ :lcd.width ], row=1 )
+	lcd.setHardwareScroll( False )
+
+	results[ 'clear' ] = measure( lambda i: lcd.clear(), 5 )
+	results[ 'clear' ][ 'ok' ] = check( '' )
+	return results
+
+def run():
+	results = {}
+
+	lcd = lcd_i2c_class.ScrollingLCD()
+	lcd.initialize()
+	for batched in ( False, True ):
+		lcd.transport.driver.batched = batched
+		name = 'i2c, batched' if batched else 'i2c'
+		for case, result in cases( lcd, i2cDisplay ).items():
+			results[ '{}: {}'.format( name, case ) ] = result
+
+	# 4-bit wiring and 8-bit wiring on spare GPIOs for D0-D3
+	for name, data_pins in ( ( 'gpio', lcd_class.DATA_PINS ), ( 'gpio, 8-bit', [ 5, 6, 12, 13 ] + lcd_class.DATA_PINS ) ):
+		hardware.gpio.set_wiring( lcd_class.LCD_RS, lcd_class.LCD_E, data_pins, lcd_class.LCD_RW )
+		lcd = lcd_class.ScrollingLCD( lcd_class.GPIOTransport( data_pins=data_pins ) )
+		lcd.initialize()
+		for case, result in cases( lcd, gpioDisplay ).items():
+			results[ '{}: {}'.format( name, case ) ] = result
+	return results
+
+def report( results ):
+	print( "{:<46} {:>8} {:>8} {:>8} {:>10}  {}".format( 'case (per call)', 'i2c tx', 'bytes', 'gpio', 'time [ms]', 'screen' ) )
+	for name, result in results.items():
+		print( "{:<46} {:>8.1f} {:>8.1f} {:>8.1f} {:>10.3f}  {}".format( name,
+			result[ 'transactions' ], result[ 'bytes' ], result[ 'gpio_calls' ],
+			result[ 'time_ms' ], 'ok' if result[ 'ok' ] else 'MISMATCH' ) )
+
+# Return the cases that are slower than in the baseline
+def regressions( results, baseline, tolerance ):
+	slower = []
+	for name, result in results.items():
+		if name in baseline and result[ 'time_ms' ] > baseline[ name ][ 'time_ms' ] * ( 1 + tolerance ) + 1e-6:
+			slower.append( ( name, baseline[ name ][ 'time_ms' ], result[ 'time_ms' ] ) )
+	return slower
+
+def main():
+	parser = argparse.ArgumentParser( description='Bus cost benchmark for the display classes' )
+	parser.add_argument( '--json', help='write the results to this file' )
+	parser.add_argument( '--baseline', help='compare with the results of an earlier --json run' )
+	parser.add_argument( '--tolerance', type=float, default=0.1, help='allowed slowdown (default 0.1)' )
+	args = parser.parse_args()
+
+	results = run()
+	report( results )
+
+	if args.json:
+		with open( args.json, 'w' ) as f:
+			json.dump( results, f, indent=1 )
+
+	failed = not all( result[ 'ok' ] for result in results.values() )
+	if args.baseline:
+		with open( args.baseline ) as f:
+			baseline = json.load( f )
+		for name, before, after in regressions( results, baseline, args.tolerance ):
+			print( "SLOWER: {} {:.3f} ms -> {:.3f} ms".format( name, before, after ) )
+			failed = True
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit( main() )
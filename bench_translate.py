@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Micro-benchmark for the special character translation
+#
+# Compares the former chain of str.replace calls with the translation
+# table in lcd_charmap, called the way the scroller calls it: the same
+# title over and over again.
+#
+# Usage: python bench_translate.py
+#
+
+import timeit
+
+from lcd_charmap import translate
+
+# Former implementation of LCD.translateSpecialChars, kept for comparison
+def legacyTranslate( sp, display_umlauts=True ):
+	s = sp
+
+	# Currency
+	s = s.replace(chr(156), '#')	   # Pound by hash
+	s = s.replace(chr(169), '(c)')	   # Copyright
+
+	# Spanish french
+	s = s.replace(chr(241), 'n')	   # Small tilde n
+	s = s.replace(chr(191), '?')	   # Small u acute to u
+	s = s.replace(chr(224), 'a')	   # Small reverse a acute to a
+	s = s.replace(chr(225), 'a')	   # Small a acute to a
+	s = s.replace(chr(232), 'e')	   # Small e grave to e
+	s = s.replace(chr(233), 'e')	   # Small e acute to e
+	s = s.replace(chr(237), 'i')	   # Small i acute to i
+	s = s.replace(chr(238), 'i')	   # Small i circumflex to i
+	s = s.replace(chr(243), 'o')	   # Small o acute to o
+	s = s.replace(chr(244), 'o')	   # Small o circumflex to o
+	s = s.replace(chr(250), 'u')	   # Small u acute to u
+	s = s.replace(chr(193), 'A')	   # Capital A acute to A
+	s = s.replace(chr(201), 'E')	   # Capital E acute to E
+	s = s.replace(chr(205), 'I')	   # Capital I acute to I
+	s = s.replace(chr(209), 'N')	   # Capital N acute to N
+	s = s.replace(chr(211), 'O')	   # Capital O acute to O
+	s = s.replace(chr(218), 'U')	   # Capital U acute to U
+	s = s.replace(chr(220), 'U')	   # Capital U umlaut to U
+	s = s.replace(chr(231), 'c')	   # Small c Cedilla
+	s = s.replace(chr(199), 'C')	   # Capital C Cedilla
+
+	# German
+	s = s.replace(chr(196), "Ae")		# A umlaut
+	s = s.replace(chr(214), "Oe")		# O umlaut
+	s = s.replace(chr(220), "Ue")		# U umlaut
+
+	if display_umlauts:
+		s = s.replace(chr(223), chr(226))	# Sharp s
+		s = s.replace(chr(246), chr(239))	# o umlaut
+		s = s.replace(chr(228), chr(225))	# a umlaut
+		s = s.replace(chr(252), chr(245))	# u umlaut
+	else:
+		s = s.replace(chr(228), "ae")		# a umlaut
+		s = s.replace(chr(223), "ss")		# Sharp s
+		s = s.replace(chr(246), "oe")		# o umlaut
+		s = s.replace(chr(252), "ue")		# u umlaut
+	return s
+
+
+TEXTS = [
+	'Buena Vista Social Club',
+	'Die \xc4rzte - M\xe4dchen aus \xd6sterreich',
+	'Gr\xf6\xdfenwahn \xfcber Stra\xdfen',
+]
+
+CALLS = 20000
+
+def main():
+	for text in TEXTS:
+		for umlauts in ( True, False ):
+			assert legacyTranslate( text, umlauts ) == translate( text, umlauts )
+
+	for name, function in ( ( 'str.replace chain', legacyTranslate ), ( 'table + cache', translate ) ):
+		seconds = min( timeit.repeat( lambda: [ function( text ) for text in TEXTS ], number=CALLS // len(TEXTS), repeat=3 ) )
+		print( "{:<20} {:8.2f} us/call".format( name, seconds / CALLS * 1e6 ) )
+
+	translate.cache_clear()
+	seconds = min( timeit.repeat( lambda: [ translate.__wrapped__( text ) for text in TEXTS ], number=CALLS // len(TEXTS), repeat=3 ) )
+	print( "{:<20} {:8.2f} us/call".format( 'table, uncached', seconds / CALLS * 1e6 ) )
+
+if __name__ == '__main__':
+	main()
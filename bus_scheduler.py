@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+# Shared owner thread for a display bus
+#
+# Several displays on one I2C bus (PCF8574 backpacks on different
+# addresses) must not write at the same time, and a long repaint of one
+# display must not stall the scrolling of another. All writes to a bus go
+# through one BusScheduler thread: every display gets a BusClient with its
+# own queue, and the thread takes one job from each waiting client in
+# turn.
+#
+# Jobs that have to wait on the hardware (the execution time of clear and
+# return home, the strobe delays of unbatched writes) are generators that
+# yield the seconds to wait. The wait becomes a not-before time of their
+# client instead of a sleep of the thread: the rest of the job runs once
+# it has passed, the other clients use the bus meanwhile.
+#
+# The thread is started by the first job, not when the scheduler is
+# created, and started again in a forked child (the daemon forks after
+# the display has been set up), so a scheduler can be created at import.
+#
+
+import os
+import inspect
+import threading
+from time import monotonic, sleep
+from collections import deque
+from concurrent.futures import Future
+
+class BusScheduler:
+	"""Runs the jobs of all clients of one bus, round robin."""
+
+	def __init__( self, name='bus' ):
+		self.name = name
+		self._condition = threading.Condition()
+		self.clients = []
+		self.turn = 0
+		# owner thread and the process it runs in
+		self.thread = None
+		self.pid = os.getpid()
+
+	# Lock of the job queues. Only the forking thread survives a fork, so a
+	# child process gets a new one (the old one may be held by a thread
+	# that is gone), drops the jobs queued by the parent and starts its own
+	# owner thread with its first job.
+	@property
+	def condition( self ):
+		if self.pid != os.getpid():
+			self.pid = os.getpid()
+			self._condition = threading.Condition()
+			for client in self.clients:
+				client.jobs.clear()
+			self.thread = None
+		return self._condition
+
+	def client( self, name=None ):
+		client = BusClient( self, name )
+		with self.condition:
+			self.clients.append( client )
+		return client
+
+	# Start the owner thread if this process doesn't have one yet
+	def ensureRunning( self ):
+		with self.condition:
+			if self.thread is None:
+				self.thread = threading.Thread( target=self.run, name=self.name )
+				self.thread.daemon = True  # thread dies when main thread (only non-daemon thread) exits.
+				self.thread.start()
+
+	# Next job, starting after the client served last, as ( client, job,
+	# None ), or ( None, None, time the first waiting client is ready )
+	# when no client can go on now. Called with the condition held.
+	def nextJob( self, now ):
+		count = len( self.clients )
+		ready = None
+		for i in range( count ):
+			client = self.clients[ ( self.turn + i ) % count ]
+			if not client.jobs:
+				continue
+			if client.not_before > now:
+				ready = client.not_before if ready is None else min( ready, client.not_before )
+				continue
+			self.turn = ( self.turn + i + 1 ) % count
+			return ( client, client.jobs.popleft(), None )
+		return ( None, None, ready )
+
+	# Wait for the next job, return it with its client. Called with the
+	# condition held.
+	def waitJob( self ):
+		while True:
+			now = monotonic()
+			client, job, ready = self.nextJob( now )
+			if job is not None:
+				return ( client, job )
+			waitFor( self.condition, None if ready is None else ready - now )
+
+	def run( self ):
+		while True:
+			with self.condition:
+				client, job = self.waitJob()
+			future, function, args, kwargs = job
+			if inspect.isgenerator( function ):
+				# the rest of a job after a wait
+				self.step( client, future, function )
+				continue
+			if not future.set_running_or_notify_cancel():
+				continue
+			try:
+				result = function( *args, **kwargs )
+			except BaseException as error:
+				future.set_exception( error )
+				continue
+			if inspect.isgenerator( result ):
+				self.step( client, future, result )
+			else:
+				future.set_result( result )
+
+	# Run the steps of a job up to their next wait and queue the rest in
+	# front of the other jobs of the client
+	def step( self, client, future, steps ):
+		try:
+			delay = next( steps )
+		except StopIteration as stop:
+			future.set_result( stop.value )
+			return
+		except BaseException as error:
+			future.set_exception( error )
+			return
+		with self.condition:
+			client.not_before = monotonic() + delay
+			client.jobs.appendleft( ( future, steps, None, None ) )
+
+class BusClient:
+	"""Queue of one display on a BusScheduler."""
+
+	def __init__( self, scheduler, name=None ):
+		self.scheduler = scheduler
+		self.name = name
+		self.jobs = deque()
+		# monotonic time before which the client gets no turn
+		self.not_before = 0.0
+
+	def submit( self, function, *args, **kwargs ):
+		future = Future()
+		self.scheduler.ensureRunning()
+		with self.scheduler.condition:
+			self.jobs.append( ( future, function, args, kwargs ) )
+			self.scheduler.condition.notify()
+		return future
+
+	# Run function on the bus thread and return its result, directly when
+	# already called from there (sleeping through the waits of a
+	# generator job)
+	def call( self, function, *args ):
+		if threading.current_thread() is self.scheduler.thread:
+			return runSteps( function( *args ) )
+		return self.submit( function, *args ).result()
+
+# Wait on a condition for a notify or timeout seconds (None: no timeout).
+# The benchmark replaces it with its model clock, like sleep and monotonic.
+def waitFor( condition, timeout=None ):
+	condition.wait( timeout )
+
+# Return the result of a job, running it to its end with sleeps if it is
+# a generator
+def runSteps( result ):
+	if not inspect.isgenerator( result ):
+		return result
+	try:
+		while True:
+			sleep( next( result ) )
+	except StopIteration as stop:
+		return stop.value
+
+# One scheduler per bus
+SCHEDULERS = {}
+SCHEDULERS_LOCK = threading.Lock()
+
+# Return the scheduler of a bus, key is anything that names it
+# (e.g. ( 'i2c', 1 ))
+def schedulerFor( key ):
+	with SCHEDULERS_LOCK:
+		if key not in SCHEDULERS:
+			SCHEDULERS[ key ] = BusScheduler( 'bus {}'.format( key ) )
+		return SCHEDULERS[ key ]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#
+# Bus transaction trace and offline replay
+#
+# When tracing is on, every write to the display (I2C transactions in
+# i2c_lib, bytes sent by the GPIO transport) is stored with its monotonic
+# timestamp in a ring buffer file of fixed size records. The file is
+# memory mapped, so recording is a struct.pack_into without a system
+# call; when tracing is off the hooks only test TRACE for None.
+#
+# Replay feeds a trace into the HD44780 model of fake_hardware and
+# reports timing gaps, redundant writes and the resulting screen.
+#
+# Usage: python bus_trace.py TRACE [--gap 0.05] [--columns 16] [--rows 2]
+#
+
+import sys
+import mmap
+import struct
+import argparse
+from time import monotonic
+
+# Trace of the running process, None while tracing is off
+TRACE = None
+
+# Records kept in the ring buffer (64 bytes each)
+TRACE_RECORDS = 16384
+
+# Record kinds, CONTINUED marks the rest of a write longer than RECORD_DATA
+I2C_WRITE = 1
+I2C_READ = 2
+GPIO_COMMAND = 3
+GPIO_DATA = 4
+CONTINUED = 0x80
+
+# File header: magic, version, record size, capacity, next record
+HEADER = struct.Struct( '<4sHHII' )
+HEADER_SIZE = 16
+MAGIC = b'LCDT'
+VERSION = 1
+
+# Record: timestamp, kind, target (I2C address), data length, data
+RECORD = struct.Struct( '<dBBB' )
+RECORD_SIZE = 64
+RECORD_DATA = RECORD_SIZE - RECORD.size
+
+class BusTrace:
+	"""Ring buffer of bus writes in a memory mapped file."""
+
+	def __init__( self, path, capacity=TRACE_RECORDS ):
+		self.capacity = capacity
+		self.index = 0
+		size = HEADER_SIZE + capacity * RECORD_SIZE
+		with open( path, 'wb' ) as f:
+			f.truncate( size )
+		self.file = open( path, 'r+b' )
+		self.map = mmap.mmap( self.file.fileno(), size )
+		HEADER.pack_into( self.map, 0, MAGIC, VERSION, RECORD_SIZE, capacity, 0 )
+
+	# Store one write, data is bytes or a sequence of ints
+	def record( self, kind, target, data ):
+		now = monotonic()
+		for start in range( 0, max( len( data ), 1 ), RECORD_DATA ):
+			chunk = bytes( data[ start:start + RECORD_DATA ] )
+			offset = HEADER_SIZE + self.index * RECORD_SIZE
+			RECORD.pack_into( self.map, offset, now, kind | ( CONTINUED if start else 0 ), target, len( chunk ) )
+			self.map[ offset + RECORD.size:offset + RECORD.size + len( chunk ) ] = chunk
+			self.index = ( self.index + 1 ) % self.capacity
+		struct.pack_into( '<I', self.map, HEADER_SIZE - 4, self.index )
+
+	def close( self ):
+		self.map.flush()
+		self.map.close()
+		self.file.close()
+
+# Start tracing all bus writes of this process to path
+def start( path, capacity=TRACE_RECORDS ):
+	global TRACE
+	stop()
+	TRACE = BusTrace( path, capacity )
+
+def stop():
+	global TRACE
+	if TRACE is not None:
+		trace, TRACE = TRACE, None
+		trace.close()
+
+# Return the writes of a trace file, oldest first, as ( time, kind,
+# target, bytes ) tuples
+def readTrace( path ):
+	with open( path, 'rb' ) as f:
+		content = f.read()
+	magic, version, record_size, capacity, index = HEADER.unpack_from( content, 0 )
+	if magic != MAGIC or version != VERSION:
+		raise ValueError( "{} is not a bus trace".format( path ) )
+
+	writes = []
+	for i in list( range( index, capacity ) ) + list( range( index ) ):
+		offset = HEADER_SIZE + i * record_size
+		timestamp, kind, target, length = RECORD.unpack_from( content, offset )
+		if kind == 0:
+			continue
+		data = content[ offset + RECORD.size:offset + RECORD.size + length ]
+		if kind & CONTINUED:
+			# the start of a write overwritten by the ring is dropped
+			if writes and writes[ -1 ][ 0 ] == timestamp:
+				previous = writes[ -1 ]
+				writes[ -1 ] = ( previous[ 0 ], previous[ 1 ], previous[ 2 ], previous[ 3 ] + data )
+			continue
+		writes.append( ( timestamp, kind, target, data ) )
+	return writes
+
+
+# Replay
+
+# Instructions that are expected to repeat (cursor/display shift, addresses)
+def isRepeatable( value ):
+	return value & 0x80 or value & 0x40 or ( value & 0xF0 ) == 0x10
+
+def replayDisplay():
+	from fake_hardware import HD44780
+
+	# HD44780 model that counts writes without an effect
+	class ReplayHD44780( HD44780 ):
+		redundant_characters = 0
+		redundant_instructions = 0
+		last_instruction = None
+
+		def execute( self, rs, value ):
+			if not rs:
+				if value == self.last_instruction and not isRepeatable( value ):
+					self.redundant_instructions += 1
+				self.last_instruction = value
+			elif not self.cgram_mode and self.ddram[ self.address ] == value:
+				self.redundant_characters += 1
+			super( ReplayHD44780, self ).execute( rs, value )
+
+	return ReplayHD44780()
+
+# Feed the writes into display models, one per I2C address plus one for
+# the GPIO wiring. Returns { target: ( display, redundant port writes ) }.
+def replay( writes ):
+	from fake_hardware import FakePCF8574
+
+	expanders = {}
+	redundant_ports = {}
+	gpio = None
+	for timestamp, kind, target, data in writes:
+		if kind == I2C_WRITE:
+			if target not in expanders:
+				expanders[ target ] = FakePCF8574()
+				expanders[ target ].display = replayDisplay()
+				redundant_ports[ target ] = 0
+			expander = expanders[ target ]
+			for value in data:
+				if value == expander.port:
+					redundant_ports[ target ] += 1
+				expander.write( value )
+		elif kind in ( GPIO_COMMAND, GPIO_DATA ):
+			if gpio is None:
+				gpio = replayDisplay()
+			for value in data:
+				gpio.execute( kind == GPIO_DATA, value )
+
+	displays = { 'i2c 0x{:02x}'.format( address ): ( expander.display, redundant_ports[ address ] )
+		for address, expander in expanders.items() }
+	if gpio is not None:
+		displays[ 'gpio' ] = ( gpio, 0 )
+	return displays
+
+# Pauses between consecutive writes longer than gap, longest first
+def gaps( writes, gap ):
+	found = []
+	for before, after in zip( writes, writes[ 1: ] ):
+		if after[ 0 ] - before[ 0 ] > gap:
+			found.append( ( after[ 0 ] - before[ 0 ], before[ 0 ] ) )
+	return sorted( found, reverse=True )
+
+def report( writes, gap, columns, rows ):
+	from lcd_geometry import rowOffsets
+
+	if not writes:
+		print( "empty trace" )
+		return
+	start = writes[ 0 ][ 0 ]
+	print( "{} writes, {} bytes in {:.3f} s".format( len( writes ),
+		sum( len( write[ 3 ] ) for write in writes ), writes[ -1 ][ 0 ] - start ) )
+
+	found = gaps( writes, gap )
+	print( "{} gaps longer than {} s".format( len( found ), gap ) )
+	for length, timestamp in found[ :10 ]:
+		print( "  {:10.3f} s after start: {:.3f} s".format( timestamp - start, length ) )
+
+	for name, ( display, redundant_ports ) in replay( writes ).items():
+		print( "{}: {} instructions, {} characters".format( name, display.instructions, display.characters ) )
+		print( "  redundant: {} characters, {} instructions, {} expander writes".format(
+			display.redundant_characters, display.redundant_instructions, redundant_ports ) )
+		for row in display.screen( columns, rowOffsets( columns, rows ) ):
+			print( "  |{}|".format( row ) )
+
+def main():
+	parser = argparse.ArgumentParser( description='Replay a bus trace into a HD44780 model' )
+	parser.add_argument( 'trace', help='trace file written by bus_trace.start()' )
+	parser.add_argument( '--gap', type=float, default=0.05, help='report pauses longer than this [s]' )
+	parser.add_argument( '--columns', type=int, default=16, help='display columns (default 16)' )
+	parser.add_argument( '--rows', type=int, default=2, choices=( 1, 2, 4 ), help='display rows (default 2)' )
+	args = parser.parse_args()
+
+	report( readTrace( args.trace ), args.gap, args.columns, args.rows )
+	return 0
+
+if __name__ == '__main__':
+	sys.exit( main() )
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+#
+# Fake SMBus and RPi.GPIO backends for running the display drivers
+# without a Raspberry Pi
+#
+# Every bus transaction and GPIO call is recorded with a timestamp of a
+# modelled clock. The clock advances by the estimated cost of each
+# transaction and by the requested sleep times (plus the usual overshoot
+# of short sleeps), so the recorded times estimate the wall time on a
+# Pi. An HD44780 model decodes the writes to check what ends up on the
+# display.
+#
+# Usage:
+#	import fake_hardware
+#	hardware = fake_hardware.install()	# before importing the drivers
+#	import lcd_i2c_class
+#	hardware.useModelClock( i2c_lib, i2c_lcd_driver, lcd_core, lcd_class, bus_scheduler )
+#
+
+import sys
+import types
+from collections import namedtuple
+
+# Modelled costs [s]
+I2C_TRANSACTION_COST = 0.00012	# start, address byte, stop and ioctl
+I2C_BYTE_COST = 0.00009		# one byte at 100 kHz incl. ACK
+GPIO_CALL_COST = 0.000004	# one RPi.GPIO call on a Pi Zero
+SLEEP_OVERHEAD = 0.00007	# overshoot of a short time.sleep()
+
+# PCF8574 backpack wiring (see i2c_lcd_driver)
+PCF_RS = 0x01
+PCF_RW = 0x02
+PCF_EN = 0x04
+
+# A recorded transaction
+Transaction = namedtuple( 'Transaction', 'time kind target data' )
+
+
+# Clock that only advances when the drivers sleep or use the bus
+class ModelClock:
+	def __init__( self ):
+		self.now = 0.0
+		self.slept = 0.0
+
+	def sleep( self, seconds ):
+		self.now += seconds + SLEEP_OVERHEAD
+		self.slept += seconds + SLEEP_OVERHEAD
+
+	def monotonic( self ):
+		return self.now
+
+	# bus_scheduler.waitFor: a timed wait passes like a sleep
+	def waitFor( self, condition, timeout=None ):
+		if timeout is None:
+			condition.wait()
+		else:
+			self.sleep( timeout )
+
+	def time( self ):
+		return self.now
+
+	def advance( self, seconds ):
+		self.now += seconds
+
+
+# Model of the HD44780 controller, fed with the nibbles or bytes latched
+# on each falling edge of the enable line
+class HD44780:
+	def __init__( self ):
+		self.ddram = [ 0x20 ] * 0x80
+		self.cgram = [ 0 ] * 0x40
+		self.address = 0
+		self.cgram_mode = False
+		self.shift = 0
+		self.eight_bit = True
+		self.two_lines = True
+		self.display_on = False
+		self.cursor = False
+		self.blink = False
+		self.pending = None
+		self.instructions = 0
+		self.characters = 0
+
+	# Latch four bits from D4-D7 (4-bit wiring)
+	def latchNibble( self, rs, nibble ):
+		if self.eight_bit:
+			# D0-D3 are not connected and read as low
+			self.execute( rs, nibble << 4 )
+		elif self.pending is None:
+			self.pending = nibble
+		else:
+			value = ( self.pending << 4 ) | nibble
+			self.pending = None
+			self.execute( rs, value )
+
+	# Latch a whole byte (8-bit wiring)
+	def latchByte( self, rs, value ):
+		self.execute( rs, value )
+
+	def execute( self, rs, value ):
+		if rs:
+			self.writeData( value )
+			return
+		self.instructions += 1
+		if value & 0x80:
+			self.address = value & 0x7F
+			self.cgram_mode = False
+		elif value & 0x40:
+			self.address = value & 0x3F
+			self.cgram_mode = True
+		elif value & 0x20:
+			self.eight_bit = bool( value & 0x10 )
+			self.two_lines = bool( value & 0x08 )
+			self.pending = None
+		elif value & 0x10:
+			step = 1 if value & 0x04 else -1
+			if value & 0x08:
+				# display shift: content moves right means window moves left
+				self.shift = ( self.shift - step ) % self.lineLength()
+			else:
+				self.address = self.nextAddress( self.address, step )
+		elif value & 0x08:
+			self.display_on = bool( value & 0x04 )
+			self.cursor = bool( value & 0x02 )
+			self.blink = bool( value & 0x01 )
+		elif value & 0x02:
+			self.address = 0
+			self.cgram_mode = False
+			self.shift = 0
+		elif value & 0x01:
+			self.ddram = [ 0x20 ] * 0x80
+			self.address = 0
+			self.cgram_mode = False
+			self.shift = 0
+
+	def writeData( self, value ):
+		self.characters += 1
+		if self.cgram_mode:
+			self.cgram[ self.address ] = value & 0x1F
+			self.address = ( self.address + 1 ) & 0x3F
+		else:
+			self.ddram[ self.address ] = value
+			self.address = self.nextAddress( self.address, 1 )
+
+	# DDRAM cells of one line: 40 in 2-line mode, 80 in 1-line mode
+	def lineLength( self ):
+		return 40 if self.two_lines else 80
+
+	# 1-line mode counts through 0x00-0x4F, 2-line mode runs from the end
+	# of line 1 (0x27) to line 2 (0x40) and from 0x67 back to 0x00
+	def nextAddress( self, address, step ):
+		if not self.two_lines:
+			return ( address + step ) % 80
+		index = ( address & 0x3F ) + ( 40 if address & 0x40 else 0 )
+		index = ( index + step ) % 80
+		return index if index < 40 else 0x40 | ( index - 40 )
+
+	# Character codes visible in a row, row_offset is the DDRAM address
+	# of its first column
+	def row( self, row_offset, columns ):
+		length = self.lineLength()
+		base = row_offset & 0x40 if self.two_lines else 0
+		start = row_offset - base
+		return bytes( self.ddram[ base | ( ( start + self.shift + column ) % length ) ]
+			for column in range( columns ) )
+
+	# Visible text of the display, one string per row
+	def screen( self, columns=16, row_offsets=( 0x00, 0x40 ) ):
+		return [ self.row( offset, columns ).decode( 'latin-1' ) for offset in row_offsets ]
+
+
+# Fake smbus.SMBus talking to PCF8574 backpacks
+class FakeSMBus:
+	def __init__( self, hardware, port=1 ):
+		self.hardware = hardware
+		self.port = port
+
+	def _write( self, kind, addr, data ):
+		self.hardware.busTransaction( kind, addr, data )
+		for value in data:
+			self.hardware.pcf8574( addr ).write( value )
+
+	def write_byte( self, addr, value ):
+		self._write( 'write_byte', addr, [ value ] )
+
+	def write_byte_data( self, addr, cmd, value ):
+		self._write( 'write_byte_data', addr, [ cmd, value ] )
+
+	def write_block_data( self, addr, cmd, data ):
+		# SMBus block writes send a length byte after the command
+		self.hardware.busTransaction( 'write_block_data', addr, [ cmd, len( data ) ] + list( data ) )
+
+	def write_i2c_block_data( self, addr, cmd, data ):
+		self._write( 'write_i2c_block_data', addr, [ cmd ] + list( data ) )
+
+	def i2c_rdwr( self, *messages ):
+		for message in messages:
+			self._write( 'i2c_rdwr', message.addr, list( message.buf ) )
+
+	def read_byte( self, addr ):
+		self.hardware.busTransaction( 'read_byte', addr, [] )
+		return self.hardware.pcf8574( addr ).read()
+
+	def read_byte_data( self, addr, cmd ):
+		self.hardware.busTransaction( 'read_byte_data', addr, [ cmd ] )
+		return 0
+
+	def read_block_data( self, addr, cmd ):
+		self.hardware.busTransaction( 'read_block_data', addr, [ cmd ] )
+		return []
+
+	def close( self ):
+		return
+
+
+# smbus2.i2c_msg replacement
+class FakeI2CMessage:
+	def __init__( self, addr, buf ):
+		self.addr = addr
+		self.buf = bytes( buf )
+
+	@staticmethod
+	def write( addr, buf ):
+		return FakeI2CMessage( addr, buf )
+
+
+# PCF8574 port expander driving a HD44780 in 4-bit mode
+class FakePCF8574:
+	def __init__( self ):
+		self.port = 0
+		self.display = HD44780()
+
+	def write( self, value ):
+		# HD44780 latches on the falling edge of EN
+		if self.port & PCF_EN and not value & PCF_EN and not self.port & PCF_RW:
+			self.display.latchNibble( self.port & PCF_RS, ( self.port >> 4 ) & 0x0F )
+		self.port = value
+
+	def read( self ):
+		# the controller is never busy in the model
+		return self.port & 0x7F
+
+
+# Fake RPi.GPIO, wired to a HD44780 through set_wiring()
+class FakeGPIO:
+	BCM = 11
+	BOARD = 10
+	OUT = 0
+	IN = 1
+	HIGH = 1
+	LOW = 0
+
+	def __init__( self, hardware ):
+		self.hardware = hardware
+		self.levels = {}
+		self.directions = {}
+		self.display = HD44780()
+		self.wiring = None
+
+	# rs, e and rw pin numbers, data pins as list (D4-D7 or D0-D7)
+	def set_wiring( self, rs, e, data, rw=None ):
+		self.wiring = ( rs, e, list( data ), rw )
+
+	def _call( self, name, *args ):
+		self.hardware.gpioCall( name, args )
+
+	def setwarnings( self, flag ):
+		self._call( 'setwarnings', flag )
+
+	def setmode( self, mode ):
+		self._call( 'setmode', mode )
+
+	def setup( self, channels, direction, **kwargs ):
+		self._call( 'setup', channels, direction )
+		for channel in self._list( channels ):
+			self.directions[ channel ] = direction
+
+	def output( self, channels, values ):
+		self._call( 'output', channels, values )
+		channels = self._list( channels )
+		if isinstance( values, ( list, tuple ) ):
+			values = list( values )
+		else:
+			values = [ values ] * len( channels )
+		for channel, value in zip( channels, values ):
+			self._setLevel( channel, bool( value ) )
+
+	def input( self, channel ):
+		self._call( 'input', channel )
+		# the controller is never busy in the model
+		return self.levels.get( channel, False ) and self.directions.get( channel ) != self.IN
+
+	def cleanup( self, *args ):
+		self._call( 'cleanup' )
+
+	def PWM( self, channel, frequency ):
+		return FakePWM( self, channel, frequency )
+
+	def _list( self, channels ):
+		if isinstance( channels, ( list, tuple ) ):
+			return list( channels )
+		return [ channels ]
+
+	def _setLevel( self, channel, level ):
+		previous = self.levels.get( channel, False )
+		self.levels[ channel ] = level
+		if self.wiring is None:
+			return
+		rs, e, data, rw = self.wiring
+		if channel != e or not previous or level:
+			return
+		# falling edge of E: latch unless reading
+		if rw is not None and self.levels.get( rw, False ):
+			return
+		value = 0
+		for bit, pin in enumerate( data ):
+			if self.levels.get( pin, False ):
+				value |= 1 << bit
+		if len( data ) == 8:
+			self.display.latchByte( self.levels.get( rs, False ), value )
+		else:
+			self.display.latchNibble( self.levels.get( rs, False ), value )
+
+
+# RPi.GPIO.PWM replacement
+class FakePWM:
+	def __init__( self, gpio, channel, frequency ):
+		self.gpio = gpio
+		self.channel = channel
+		self.frequency = frequency
+		self.duty_cycle = None
+		gpio._call( 'PWM', channel, frequency )
+
+	def start( self, duty_cycle ):
+		self.gpio._call( 'PWM.start', self.channel, duty_cycle )
+		self.duty_cycle = duty_cycle
+
+	def ChangeDutyCycle( self, duty_cycle ):
+		self.gpio._call( 'PWM.ChangeDutyCycle', self.channel, duty_cycle )
+		self.duty_cycle = duty_cycle
+
+	def ChangeFrequency( self, frequency ):
+		self.gpio._call( 'PWM.ChangeFrequency', self.channel, frequency )
+		self.frequency = frequency
+
+	def stop( self ):
+		self.gpio._call( 'PWM.stop', self.channel )
+		self.duty_cycle = None
+
+
+# Recorder shared by the fake backends
+class FakeHardware:
+	def __init__( self ):
+		self.clock = ModelClock()
+		self.gpio = FakeGPIO( self )
+		self.expanders = {}
+		self.reset()
+
+	# Forget the recorded transactions (the display state is kept)
+	def reset( self ):
+		self.transactions = []
+
+	def pcf8574( self, addr ):
+		if addr not in self.expanders:
+			self.expanders[ addr ] = FakePCF8574()
+		return self.expanders[ addr ]
+
+	def busTransaction( self, kind, addr, data ):
+		self.clock.advance( I2C_TRANSACTION_COST + I2C_BYTE_COST * len( data ) )
+		self.transactions.append( Transaction( self.clock.now, kind, addr, bytes( data ) ) )
+
+	def gpioCall( self, name, args ):
+		self.clock.advance( GPIO_CALL_COST )
+		self.transactions.append( Transaction( self.clock.now, name, args, b'' ) )
+
+	# Replace sleep()/monotonic() of driver modules with the model clock
+	def useModelClock( self, *modules ):
+		for module in modules:
+			if hasattr( module, 'sleep' ):
+				module.sleep = self.clock.sleep
+			if hasattr( module, 'monotonic' ):
+				module.monotonic = self.clock.monotonic
+			if hasattr( module, 'waitFor' ):
+				module.waitFor = self.clock.waitFor
+			if isinstance( getattr( module, 'time', None ), types.ModuleType ):
+				module.time = self.clock
+
+	# Summary of the transactions recorded since the last reset
+	def stats( self ):
+		bus = [ t for t in self.transactions if isinstance( t.target, int ) ]
+		return dict(
+			transactions=len( bus ),
+			bytes=sum( len( t.data ) for t in bus ),
+			gpio_calls=len( self.transactions ) - len( bus ),
+		)
+
+
+# Register fake smbus, smbus2 (with rdwr=True) and RPi.GPIO modules
+def install( rdwr=False ):
+	hardware = FakeHardware()
+
+	smbus = types.ModuleType( 'smbus' )
+	smbus.SMBus = lambda port=1: FakeSMBus( hardware, port )
+	sys.modules[ 'smbus' ] = smbus
+	if rdwr:
+		smbus2 = types.ModuleType( 'smbus2' )
+		smbus2.SMBus = smbus.SMBus
+		smbus2.i2c_msg = FakeI2CMessage
+		sys.modules[ 'smbus2' ] = smbus2
+	else:
+		# make sure i2c_lib falls back to the fake smbus
+		sys.modules[ 'smbus2' ] = None
+
+	rpi = types.ModuleType( 'RPi' )
+	rpi.GPIO = hardware.gpio
+	sys.modules[ 'RPi' ] = rpi
+	sys.modules[ 'RPi.GPIO' ] = hardware.gpio
+	return hardware
@@ -1,13 +1,27 @@
 import i2c_lib
-from time import sleep
+from time import sleep, monotonic
+from lcd_charmap import encodeText
 
-# LCD Address
+# Default LCD Address, each lcd can be given its own
 ADDRESS = 0x3F
 #ADDRESS = 0x27
 
-# I2C bus
+# Default I2C bus
 BUS = 1
 
+# Send each string as one I2C transaction instead of six per character.
+# The bus clock already covers the enable pulse width and the command
+# execution time of the HD44780.
+BATCHED = True
+
+# Poll the busy flag through the R/W line instead of waiting the worst case
+# time after every write. Needs R/W wired to the PCF8574, keep it False
+# when R/W is tied to ground.
+BUSY_POLL = False
+
+# Stop polling after this long and carry on as if the controller was ready
+BUSY_TIMEOUT = 0.005
+
 # commands
 LCD_CLEARDISPLAY = 0x01
 LCD_RETURNHOME = 0x02
@@ -61,54 +75,162 @@ class lcd:
 
   BACKLIGHT_MASK = LCD_BACKLIGHT
 
-  def __init__(self):
-    """Setup the display, turn on backlight and text display + ...?"""
-    self.device = i2c_lib.i2c_device(ADDRESS, BUS)
-
-    self.write(0x03)
-    self.write(0x03)
-    self.write(0x03)
-    self.write(0x02)
-
-    self.write(LCD_FUNCTIONSET | LCD_2LINE | LCD_5x8DOTS | LCD_4BITMODE)
-    self.write(LCD_DISPLAYCONTROL | LCD_DISPLAYON)
-    self.write(LCD_CLEARDISPLAY)
-    self.write(LCD_ENTRYMODESET | LCD_ENTRYLEFT)
-    sleep(0.2)
-
-  def strobe(self, data):
+  def __init__(self, batched=BATCHED, busy_poll=BUSY_POLL, device=None, address=ADDRESS, bus=BUS, two_line=True, geometry=None, initialize=True):
+    """Setup the display, turn on backlight and text display + ...?
+
+    geometry (lcd_geometry.Geometry) gives the line addresses of
+    display_string and display_data, 16x2 by default. Without initialize
+    the init sequence is left to initialize_steps."""
+    # lcd_geometry imports the instruction constants from here
+    from lcd_geometry import GEOMETRY_16X2
+    self.geometry = geometry or GEOMETRY_16X2
+    if device is None:
+      device = i2c_lib.i2c_device(address, bus)
+    self.device = device
+    self.batched = batched
+    self.busy_poll = busy_poll
+    if initialize:
+      self.run(self.initialize_steps(two_line))
+
+  # The *_steps methods are generators that do the bus writes of an
+  # operation and yield the seconds to wait in between. run() sleeps
+  # through them, the I2C transport lets other displays use the bus
+  # during the waits instead (see bus_scheduler).
+
+  def run(self, steps):
+    """run the steps of an operation, sleeping through its waits"""
+    for delay in steps:
+      sleep(delay)
+
+  def initialize_steps(self, two_line=True):
+    """init sequence: 4-bit mode, display on, cleared"""
+    # the init sequence relies on the delays of the unbatched writes,
+    # the busy flag can only be read once 4-bit mode is set up
+    batched, busy_poll = self.batched, self.busy_poll
+    self.batched = False
+    self.busy_poll = False
+
+    yield from self.write_steps(0x03)
+    yield from self.write_steps(0x03)
+    yield from self.write_steps(0x03)
+    yield from self.write_steps(0x02)
+
+    yield from self.write_steps(LCD_FUNCTIONSET | (LCD_2LINE if two_line else LCD_1LINE) | LCD_5x8DOTS | LCD_4BITMODE)
+    yield from self.write_steps(LCD_DISPLAYCONTROL | LCD_DISPLAYON)
+    yield from self.write_steps(LCD_CLEARDISPLAY)
+    yield from self.write_steps(LCD_ENTRYMODESET | LCD_ENTRYLEFT)
+    yield 0.2
+
+    self.batched = batched
+    self.busy_poll = busy_poll
+
+  def strobe_steps(self, data):
     """clocks EN to latch command"""
     self.device.write_cmd(data | En | self.BACKLIGHT_MASK)
-    sleep(0.0005)
+    if not self.busy_poll:
+      yield 0.0005
     self.device.write_cmd(((data & ~En) | self.BACKLIGHT_MASK))
-    sleep(0.001)
+    if not self.busy_poll:
+      yield 0.001
 
-  def write_four_bits(self, data):
+  def strobe(self, data):
+    """clocks EN to latch command"""
+    self.run(self.strobe_steps(data))
+
+  def write_four_bits_steps(self, data):
     self.device.write_cmd(data | self.BACKLIGHT_MASK)
-    self.strobe(data)
+    yield from self.strobe_steps(data)
+
+  def write_four_bits(self, data):
+    self.run(self.write_four_bits_steps(data))
+
+  def four_bits_sequence(self, data):
+    """bytes to clock in four bits: set data, raise EN, lower EN"""
+    data = data | self.BACKLIGHT_MASK
+    return [data, data | En, data & ~En]
+
+  def byte_sequence(self, value, mode=0):
+    """bytes to send a full byte as two nibbles"""
+    return (self.four_bits_sequence(mode | (value & 0xF0)) +
+            self.four_bits_sequence(mode | ((value << 4) & 0xF0)))
+
+  def write_steps(self, cmd, mode=0):
+    """write a command to lcd"""
+    if self.batched:
+      self.device.write_bytes(self.byte_sequence(cmd, mode))
+      return
+    yield from self.write_four_bits_steps(mode | (cmd & 0xF0))
+    yield from self.write_four_bits_steps(mode | ((cmd << 4) & 0xF0))
+    if self.busy_poll:
+      self.wait_ready()
 
   def write(self, cmd, mode=0):
     """write a command to lcd"""
-    self.write_four_bits(mode | (cmd & 0xF0))
-    self.write_four_bits(mode | ((cmd << 4) & 0xF0))
-
-  def display_string(self, string, line):
-    if line == 1:
-       self.write(0x80)
-    if line == 2:
-       self.write(0xC0)
-    if line == 3:
-       self.write(0x94)
-    if line == 4:
-       self.write(0xD4)
-
-    for char in string:
-       self.write(ord(char), Rs)
+    self.run(self.write_steps(cmd, mode))
+
+  def read_busy_flag(self):
+    """read the busy flag, clocks out both nibbles of the status register"""
+    # the PCF8574 pins are quasi-bidirectional: write them high to read
+    status = 0xF0 | Rw | self.BACKLIGHT_MASK
+    self.device.write_cmd(status)
+    self.device.write_cmd(status | En)
+    busy = self.device.read() & 0x80
+    self.device.write_cmd(status)
+    self.device.write_cmd(status | En)
+    self.device.write_cmd(status)
+    return bool(busy)
+
+  def wait_ready(self):
+    """wait until the controller has finished the last instruction"""
+    deadline = monotonic() + BUSY_TIMEOUT
+    while self.read_busy_flag() and monotonic() < deadline:
+      pass
+
+  def settle_steps(self, delay):
+    """wait for slow instructions, fixed delay without busy polling"""
+    if self.busy_poll:
+      self.wait_ready()
+    else:
+      yield delay
+
+  def settle(self, delay):
+    """wait for slow instructions, fixed delay without busy polling"""
+    self.run(self.settle_steps(delay))
+
+  def display_string(self, string, line, pos=0):
+    """write string to line, starting at column pos"""
+    self.display_data(encodeText(string), line, pos)
+
+  def display_data(self, data, line, pos=0):
+    """write character codes (bytes) to line, starting at column pos"""
+    self.write_data(data, self.geometry.lineAddress(line) + pos)
+
+  def write_data_steps(self, data, address=None):
+    """write character codes (bytes), after the address command if given"""
+    if self.batched:
+      sequence = []
+      if address is not None:
+        sequence = self.byte_sequence(address)
+      for code in data:
+        sequence += self.byte_sequence(code, Rs)
+      self.device.write_bytes(sequence)
+      return
+
+    if address is not None:
+      yield from self.write_steps(address)
+    for code in data:
+       yield from self.write_steps(code, Rs)
+
+  def write_data(self, data, address=None):
+    """write character codes (bytes), after the address command if given"""
+    self.run(self.write_data_steps(data, address))
 
   def clear(self):
     """clear lcd and set to home"""
     self.write(LCD_CLEARDISPLAY)
+    self.settle(0.002)
     self.write(LCD_RETURNHOME)
+    self.settle(0.002)
 
   def backlight_off(self):
     """turn off backlight, anything that calls write turns it on again"""
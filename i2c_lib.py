@@ -1,14 +1,46 @@
-import smbus
 from time import *
 
+import lcd_metrics
+import bus_trace
+
+# smbus2 can send a whole byte sequence as one combined I2C message,
+# the classic smbus module only supports block writes. Both are imported
+# when the first device is opened.
+SMBus = None
+i2c_msg = None
+
+def import_smbus():
+  global SMBus, i2c_msg
+  try:
+    from smbus2 import SMBus, i2c_msg
+  except ImportError:
+    from smbus import SMBus
+    i2c_msg = None
+
+# Maximum payload of a single SMBus block write
+I2C_BLOCK_MAX = 32
+
+# Open buses by port, devices on the same bus share one handle
+buses = {}
+
+def open_bus(port):
+  if SMBus is None:
+    import_smbus()
+  if port not in buses:
+    buses[port] = SMBus(port)
+  return buses[port]
+
 class i2c_device:
   def __init__(self, addr, port=1):
     self.addr = addr
-    self.bus = smbus.SMBus(port)   
+    self.bus = open_bus(port)
 
 # Write a single command
   def write_cmd(self, cmd):
     self.bus.write_byte(self.addr, cmd)
+    lcd_metrics.I2C_TRANSACTIONS.inc()
+    if bus_trace.TRACE is not None:
+      bus_trace.TRACE.record(bus_trace.I2C_WRITE, self.addr, (cmd,))
     sleep(0.0001)
 
 # Write a command and argument
@@ -21,9 +53,31 @@ class i2c_device:
     self.bus.write_block_data(self.addr, cmd, data)
     sleep(0.0001)
 
+# Write a sequence of raw bytes in as few transactions as possible.
+# Devices without registers (like the PCF8574) latch every byte, so the
+# first byte of a block write is just another data byte.
+  def write_bytes(self, data):
+    if bus_trace.TRACE is not None:
+      bus_trace.TRACE.record(bus_trace.I2C_WRITE, self.addr, data)
+    if i2c_msg is not None:
+      self.bus.i2c_rdwr(i2c_msg.write(self.addr, data))
+      lcd_metrics.I2C_TRANSACTIONS.inc()
+      return
+    for i in range(0, len(data), I2C_BLOCK_MAX + 1):
+      chunk = data[i:i + I2C_BLOCK_MAX + 1]
+      if len(chunk) == 1:
+        self.bus.write_byte(self.addr, chunk[0])
+      else:
+        self.bus.write_i2c_block_data(self.addr, chunk[0], chunk[1:])
+    lcd_metrics.I2C_TRANSACTIONS.inc((len(data) + I2C_BLOCK_MAX) // (I2C_BLOCK_MAX + 1))
+
 # Read a single byte
   def read(self):
-    return self.bus.read_byte(self.addr)
+    lcd_metrics.I2C_TRANSACTIONS.inc()
+    value = self.bus.read_byte(self.addr)
+    if bus_trace.TRACE is not None:
+      bus_trace.TRACE.record(bus_trace.I2C_READ, self.addr, (value,))
+    return value
 
 # Read 
   def read_data(self, cmd):
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+# Local API for other services on the box to write to the display
+#
+# The daemon listens on a Unix socket for newline separated JSON requests:
+#
+#   {"line": 2, "text": "Network down"}                 pin a line
+#   {"line": 2, "text": null}                           release it
+#   {"line": 2, "overlay": "Volume 42%", "seconds": 2}  show for 2 seconds
+#
+# Each request is answered with {"ok": true} or {"error": "..."}. Requests
+# only change the wanted state of a line (DisplayRegions); the daemon
+# shows the latest state on its next frame, so a burst of updates costs
+# one render and, through the framebuffer, only the changed cells.
+#
+# Usage: python lcd_api.py [--socket PATH] line LINE TEXT
+#        python lcd_api.py [--socket PATH] release LINE
+#        python lcd_api.py [--socket PATH] overlay LINE TEXT [--seconds 2]
+#
+
+import os
+import sys
+import json
+import socket
+import asyncio
+import argparse
+
+# Socket of the daemon and its permissions
+API_SOCKET = '/run/lcd-mpc.sock'
+API_SOCKET_MODE = 0o660
+
+# Longest overlay [s]
+OVERLAY_MAX_SECONDS = 3600
+
+# Longest request line [bytes]
+REQUEST_MAX = 4096
+
+class DisplayRegions:
+	"""Wanted text of each line: overlay before pinned text before the daemon's own."""
+
+	def __init__( self, rows ):
+		self.rows = rows
+		self.base = [ '' ] * rows
+		self.pinned = {}
+		# line -> ( text, until )
+		self.overlays = {}
+
+	# Ignores lines the display doesn't have
+	def setBase( self, line, text ):
+		if 0 < line <= self.rows:
+			self.base[ line - 1 ] = text
+
+	def pin( self, line, text ):
+		if text is None:
+			self.pinned.pop( line, None )
+		else:
+			self.pinned[ line ] = text
+
+	def overlay( self, line, text, until ):
+		self.overlays[ line ] = ( text, until )
+
+	# Lines to show at time now, expired overlays are dropped
+	def compose( self, now ):
+		for line, ( text, until ) in list( self.overlays.items() ):
+			if until <= now:
+				del self.overlays[ line ]
+		lines = []
+		for line in range( 1, self.rows + 1 ):
+			if line in self.overlays:
+				lines.append( self.overlays[ line ][ 0 ] )
+			else:
+				lines.append( self.pinned.get( line, self.base[ line - 1 ] ) )
+		return lines
+
+	# Time the next overlay ends, None without overlays
+	def nextExpiry( self ):
+		return min( ( until for text, until in self.overlays.values() ), default=None )
+
+	# Apply a request (dict), raises ValueError if it is malformed
+	def apply( self, request, now ):
+		if not isinstance( request, dict ):
+			raise ValueError( 'request must be an object' )
+		line = request.get( 'line' )
+		if not isinstance( line, int ) or not 0 < line <= self.rows:
+			raise ValueError( 'line must be 1 to {}'.format( self.rows ) )
+		if 'overlay' in request:
+			text = request[ 'overlay' ]
+			seconds = request.get( 'seconds', 2 )
+			if not isinstance( text, str ):
+				raise ValueError( 'overlay must be a string' )
+			if not isinstance( seconds, ( int, float ) ) or not 0 < seconds <= OVERLAY_MAX_SECONDS:
+				raise ValueError( 'seconds must be between 0 and {}'.format( OVERLAY_MAX_SECONDS ) )
+			self.overlay( line, text, now + seconds )
+		elif 'text' in request:
+			text = request[ 'text' ]
+			if text is not None and not isinstance( text, str ):
+				raise ValueError( 'text must be a string or null' )
+			self.pin( line, text )
+		else:
+			raise ValueError( 'request needs text or overlay' )
+
+class APIServer:
+	"""Unix socket server that applies requests to DisplayRegions.
+
+	changed() is called on the event loop after every applied request."""
+
+	def __init__( self, regions, changed, path=API_SOCKET ):
+		self.regions = regions
+		self.changed = changed
+		self.path = path
+		self.server = None
+
+	async def start( self ):
+		if os.path.exists( self.path ):
+			os.unlink( self.path )
+		self.server = await asyncio.start_unix_server( self.handle, self.path, limit=REQUEST_MAX )
+		os.chmod( self.path, API_SOCKET_MODE )
+
+	async def stop( self ):
+		if self.server is not None:
+			self.server.close()
+			await self.server.wait_closed()
+			self.server = None
+		if os.path.exists( self.path ):
+			os.unlink( self.path )
+
+	async def handle( self, reader, writer ):
+		loop = asyncio.get_running_loop()
+		try:
+			while True:
+				try:
+					request = await reader.readline()
+				except ( ValueError, asyncio.LimitOverrunError ):
+					break
+				if not request:
+					break
+				try:
+					self.regions.apply( json.loads( request ), loop.time() )
+					reply = { 'ok': True }
+				except ValueError as error:
+					reply = { 'error': str( error ) }
+				else:
+					self.changed()
+				writer.write( ( json.dumps( reply ) + '\n' ).encode() )
+				await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+# Send one request to the daemon and return its reply
+def send( request, path=API_SOCKET ):
+	with socket.socket( socket.AF_UNIX, socket.SOCK_STREAM ) as connection:
+		connection.connect( path )
+		connection.sendall( ( json.dumps( request ) + '\n' ).encode() )
+		reply = connection.makefile( 'r', encoding='utf-8' ).readline()
+	return json.loads( reply )
+
+def main():
+	parser = argparse.ArgumentParser( description='Write to the display of the LCD-MPC daemon' )
+	parser.add_argument( '--socket', default=API_SOCKET, help='socket of the daemon (default {})'.format( API_SOCKET ) )
+	commands = parser.add_subparsers( dest='command', required=True )
+	line = commands.add_parser( 'line', help='pin text to a line' )
+	line.add_argument( 'line', type=int )
+	line.add_argument( 'text' )
+	release = commands.add_parser( 'release', help='give a pinned line back to the daemon' )
+	release.add_argument( 'line', type=int )
+	overlay = commands.add_parser( 'overlay', help='show text on a line for a while' )
+	overlay.add_argument( 'line', type=int )
+	overlay.add_argument( 'text' )
+	overlay.add_argument( '--seconds', type=float, default=2 )
+	args = parser.parse_args()
+
+	if args.command == 'line':
+		request = { 'line': args.line, 'text': args.text }
+	elif args.command == 'release':
+		request = { 'line': args.line, 'text': None }
+	else:
+		request = { 'line': args.line, 'overlay': args.text, 'seconds': args.seconds }
+
+	reply = send( request, args.socket )
+	if 'error' in reply:
+		print( reply[ 'error' ], file=sys.stderr )
+		return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit( main() )
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#
+# Translation of special characters (umlauts etc) to LCD values
+# See standard character patterns for LCD display
+#
+# The translation tables are built once at import, one for each
+# display_umlauts setting, and translated texts are cached so that a
+# scrolling title is only translated once.
+#
+# encodeText is the codec used by the display classes: it maps Unicode
+# text straight to the character codes of the A00 (Japanese) or A02
+# (European) character ROM and returns bytes.
+#
+
+import functools
+import unicodedata
+
+# Number of translated texts to keep
+TRANSLATION_CACHE_SIZE = 64
+
+# Replacements used regardless of the umlaut setting
+SPECIAL_CHARS = [
+	# Currency
+	( 156, '#' ),		# Pound by hash
+	( 169, '(c)' ),		# Copyright
+
+	# Spanish french
+	( 241, 'n' ),		# Small tilde n
+	( 191, '?' ),		# Small u acute to u
+	( 224, 'a' ),		# Small reverse a acute to a
+	( 225, 'a' ),		# Small a acute to a
+	( 232, 'e' ),		# Small e grave to e
+	( 233, 'e' ),		# Small e acute to e
+	( 237, 'i' ),		# Small i acute to i
+	( 238, 'i' ),		# Small i circumflex to i
+	( 243, 'o' ),		# Small o acute to o
+	( 244, 'o' ),		# Small o circumflex to o
+	( 250, 'u' ),		# Small u acute to u
+	( 193, 'A' ),		# Capital A acute to A
+	( 201, 'E' ),		# Capital E acute to E
+	( 205, 'I' ),		# Capital I acute to I
+	( 209, 'N' ),		# Capital N acute to N
+	( 211, 'O' ),		# Capital O acute to O
+	( 218, 'U' ),		# Capital U acute to U
+	( 220, 'U' ),		# Capital U umlaut to U
+	( 231, 'c' ),		# Small c Cedilla
+	( 199, 'C' ),		# Capital C Cedilla
+
+	# German
+	( 196, 'Ae' ),		# A umlaut
+	( 214, 'Oe' ),		# O umlaut
+	( 220, 'Ue' ),		# U umlaut
+]
+
+# Small umlauts if the display can show them
+UMLAUTS_LCD = [
+	( 223, chr(226) ),	# Sharp s
+	( 246, chr(239) ),	# o umlaut
+	( 228, chr(225) ),	# a umlaut
+	( 252, chr(245) ),	# u umlaut
+]
+
+# Small umlauts if the display can't show them
+UMLAUTS_ASCII = [
+	( 228, 'ae' ),		# a umlaut
+	( 223, 'ss' ),		# Sharp s
+	( 246, 'oe' ),		# o umlaut
+	( 252, 'ue' ),		# u umlaut
+]
+
+# Build a str.translate table, the first entry for a character wins
+def buildTable( replacements ):
+	table = {}
+	for code, replacement in replacements:
+		table.setdefault( code, replacement )
+	return table
+
+# Translation table for each display_umlauts setting
+TRANSLATION_TABLES = {
+	True: buildTable( SPECIAL_CHARS + UMLAUTS_LCD ),
+	False: buildTable( SPECIAL_CHARS + UMLAUTS_ASCII ),
+}
+
+# Translate special characters of text to LCD values
+@functools.lru_cache( maxsize=TRANSLATION_CACHE_SIZE )
+def translate( text, display_umlauts=True ):
+	if text.isascii():
+		return text
+	return text.translate( TRANSLATION_TABLES[ bool(display_umlauts) ] )
+
+
+# Character ROM of the controller: 'A00' (Japanese, the common one) or
+# 'A02' (European)
+DEFAULT_ROM = 'A00'
+
+# Code shown for characters without any replacement
+UNKNOWN_CODE = ord( '?' )
+
+# Characters of the A00 ROM outside of ASCII
+ROM_A00 = {
+	'\u00a5': 0x5C,	# Yen sign instead of backslash
+	'\u2192': 0x7E,	# Right arrow instead of tilde
+	'\u2190': 0x7F,	# Left arrow
+	'\u00b7': 0xA5,	# Middle dot
+	'\u00b0': 0xDF,	# Degree sign (semi-voiced mark)
+	'\u03b1': 0xE0,	# Alpha
+	'\u00e4': 0xE1,	# a umlaut
+	'\u00df': 0xE2,	# Sharp s (beta)
+	'\u03b2': 0xE2,	# Beta
+	'\u03b5': 0xE3,	# Epsilon
+	'\u00b5': 0xE4,	# Micro sign
+	'\u03bc': 0xE4,	# Mu
+	'\u03c3': 0xE5,	# Sigma
+	'\u03c1': 0xE6,	# Rho
+	'\u221a': 0xE8,	# Square root
+	'\u00a2': 0xEC,	# Cent sign
+	'\u00a3': 0xED,	# Pound sign
+	'\u00f1': 0xEE,	# n tilde
+	'\u00f6': 0xEF,	# o umlaut
+	'\u03b8': 0xF2,	# Theta
+	'\u221e': 0xF3,	# Infinity
+	'\u03a9': 0xF4,	# Omega
+	'\u00fc': 0xF5,	# u umlaut
+	'\u03a3': 0xF6,	# Capital sigma
+	'\u03c0': 0xF7,	# Pi
+	'\u00f7': 0xFD,	# Division sign
+	'\u2588': 0xFF,	# Full block
+}
+# Half-width katakana and punctuation U+FF61-U+FF9F are 0xA1-0xDF
+ROM_A00.update( ( chr( 0xFF61 + code - 0xA1 ), code ) for code in range( 0xA1, 0xE0 ) )
+
+# The upper half of the A02 ROM follows ISO 8859-1
+ROM_A02 = { chr( code ): code for code in range( 0xA0, 0x100 ) }
+ROM_A02.update( {
+	'\u2192': 0x10,	# Right triangle for arrows
+	'\u2190': 0x11,	# Left triangle
+} )
+
+# Characters of each ROM that only show with display_umlauts
+ROM_UMLAUTS = {
+	'A00': '\u00e4\u00f6\u00fc\u00df',
+	'A02': '\u00c4\u00d6\u00dc\u00e4\u00f6\u00fc\u00df',
+}
+
+# Replacements for characters the ROM can't show, tried before the
+# Unicode decomposition
+FALLBACKS = {
+	'\u00c4': 'Ae', '\u00d6': 'Oe', '\u00dc': 'Ue',
+	'\u00e4': 'ae', '\u00f6': 'oe', '\u00fc': 'ue', '\u00df': 'ss',
+	'\u00a9': '(c)', '\u00ae': '(R)', '\u00a3': '#', '\u00bf': '?',
+	'\u00c6': 'AE', '\u00e6': 'ae', '\u0152': 'OE', '\u0153': 'oe', '\u00d8': 'O', '\u00f8': 'o',
+	'\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"', '\u2013': '-', '\u2014': '-',
+	'\u2026': '...',
+}
+
+# ASCII characters whose codes show something else in the ROM (A00 has
+# the yen sign at 0x5C and an arrow at 0x7E) and their replacements
+ROM_ASCII_GAPS = {
+	'A00': { '\\': '/', '~': '-' },
+	'A02': {},
+}
+
+class RomTable( dict ):
+	"""str.translate table from code points to ROM codes (as str).
+
+	Characters missing in the ROM are resolved on first use through
+	FALLBACKS and the NFKD decomposition and stored in the table."""
+
+	# ascii_gaps: { char: replacement } of ASCII codes the ROM shows differently
+	def __init__( self, codes, ascii_gaps=None ):
+		super( RomTable, self ).__init__()
+		ascii_gaps = ascii_gaps or {}
+		# CGRAM slots and printable ASCII
+		for code in list( range( 0x08 ) ) + list( range( 0x20, 0x7F ) ):
+			self[ code ] = chr( code )
+		for char in ascii_gaps:
+			del self[ ord( char ) ]
+		self.fallbacks = dict( FALLBACKS, **ascii_gaps )
+		for char, code in codes.items():
+			self[ ord( char ) ] = chr( code )
+		# characters the ROM shows as they are
+		self.characters = frozenset( chr( codepoint ) for codepoint in self )
+
+	def __missing__( self, codepoint ):
+		char = chr( codepoint )
+		replacement = self.fallbacks.get( char )
+		if replacement is None:
+			# drop accents and compatibility forms: 'e\u0301' -> 'e'
+			replacement = ''.join( base for base in unicodedata.normalize( 'NFKD', char )
+				if not unicodedata.combining( base ) )
+		if not replacement or replacement == char:
+			codes = chr( UNKNOWN_CODE )
+		else:
+			codes = ''.join( self[ ord( base ) ] for base in replacement )
+		self[ codepoint ] = codes
+		return codes
+
+# Build the table of a ROM, without its umlauts unless display_umlauts
+def buildRomTable( rom, display_umlauts ):
+	codes = dict( { 'A00': ROM_A00, 'A02': ROM_A02 }[ rom ] )
+	if not display_umlauts:
+		for char in ROM_UMLAUTS[ rom ]:
+			codes.pop( char, None )
+	return RomTable( codes, ROM_ASCII_GAPS[ rom ] )
+
+# Codec table for each ( rom, display_umlauts )
+ROM_TABLES = { ( rom, display_umlauts ): buildRomTable( rom, display_umlauts )
+	for rom in ( 'A00', 'A02' ) for display_umlauts in ( True, False ) }
+
+# Encode text to the character codes (bytes) of the ROM
+@functools.lru_cache( maxsize=TRANSLATION_CACHE_SIZE )
+def encodeText( text, rom=DEFAULT_ROM, display_umlauts=True ):
+	return text.translate( ROM_TABLES[ ( rom, bool(display_umlauts) ) ] ).encode( 'latin-1' )
+
+# Characters the ROM can show without a replacement
+def romCharacters( rom=DEFAULT_ROM, display_umlauts=True ):
+	return ROM_TABLES[ ( rom, bool(display_umlauts) ) ].characters
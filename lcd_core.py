@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+#
+# Rendering core of the HD44780 display classes
+#
+# Text handling, character translation, the shadow framebuffer and
+# scrolling live here. The hardware is reached through a transport (see
+# lcd_transport): GPIOTransport in lcd_class for parallel wiring,
+# I2CTransport in lcd_i2c_class for PCF8574 backpacks and TestTransport
+# without any hardware.
+#
+
+import time
+import itertools
+import threading
+
+import lcd_metrics
+
+from i2c_lcd_driver import LCD_CLEARDISPLAY, LCD_RETURNHOME, LCD_CURSORSHIFT, LCD_DISPLAYMOVE, \
+	LCD_MOVELEFT, LCD_MOVERIGHT, LCD_SETDDRAMADDR, \
+	LCD_DISPLAYCONTROL, LCD_DISPLAYON, LCD_CURSORON, LCD_BLINKON, LCD_SETCGRAMADDR
+from lcd_framebuffer import Framebuffer
+from lcd_charmap import translate, encodeText, romCharacters, DEFAULT_ROM
+from lcd_glyphs import GlyphManager, CGRAM_SLOTS
+from lcd_geometry import GEOMETRY_16X2
+from lcd_scroll import scrollFrames, hardwareScrollOffsets, \
+	ScrollState, LineFrames, HardwareFrames, TickClock
+
+# Default display module
+LCD_GEOMETRY = GEOMETRY_16X2
+
+# Execution time of clear display and return home
+LCD_CLEAR_DELAY = 0.002
+
+class LCD:
+	# If display can support umlauts set to True else False
+	display_umlauts = True
+	
+	# enable raw mode (testing only)
+	raw_mode = False
+
+	# show characters missing in the ROM with CGRAM glyphs
+	custom_glyphs = True
+
+	# character ROM of the controller, 'A00' (Japanese) or 'A02' (European)
+	character_rom = DEFAULT_ROM
+	
+	# constructor
+	# geometry: lcd_geometry.Geometry of the module
+	def __init__( self, transport, geometry=LCD_GEOMETRY ):
+		self.transport = transport
+		self.geometry = geometry
+		# lines, one per row, replaced as a whole so readers always see a
+		# consistent set
+		self.lines = ( '', ) * geometry.rows
+		# what is currently shown on the display
+		self.framebuffer = Framebuffer()
+		self.display_shift = 0
+		self.glyphs = GlyphManager()
+		# last backlight level and display control flags sent, None
+		# while unknown
+		self.backlight = None
+		self.display_control = None
+		return
+	
+	# initialize function for delayed init
+	def initialize( self ):
+		self.transport.initialize( self.geometry.two_line )
+		self.framebuffer.clear()
+		self.display_shift = 0
+		# the init sequence leaves the display on without cursor
+		self.display_control = LCD_DISPLAYON
+		self.backlight = None
+		self.glyphs.reload()
+		
+	def clear( self ):
+		self.transport.command( LCD_CLEARDISPLAY )
+		self.transport.wait( LCD_CLEAR_DELAY )
+		self.framebuffer.clear()
+		self.display_shift = 0
+
+	# Shift the display so that the visible window starts at DDRAM
+	# column shift (used for hardware scrolling)
+	def setDisplayShift( self, shift ):
+		delta = shift - self.display_shift
+		if delta == 0:
+			return
+		if shift == 0 and abs( delta ) > 2:
+			self.transport.command( LCD_RETURNHOME )
+			self.transport.wait( LCD_CLEAR_DELAY )
+		else:
+			direction = LCD_MOVELEFT if delta > 0 else LCD_MOVERIGHT
+			for i in range( abs( delta ) ):
+				self.transport.command( LCD_CURSORSHIFT | LCD_DISPLAYMOVE | direction )
+		self.display_shift = shift
+
+	# LCD width
+	@property
+	def width( self ):
+		return self.geometry.columns
+
+	# Number of rows of the display
+	@property
+	def display_lines( self ):
+		return self.geometry.rows
+
+	# Set text at line, lines the display doesn't have are ignored
+	def setLine( self, line_number, text ):
+		if not 0 < line_number <= self.display_lines:
+			return
+		lines = list( self.lines )
+		lines[ line_number - 1 ] = text
+		self.lines = tuple( lines )
+		
+	def getLine( self, line_number ):
+		return self.lines[ line_number - 1 ]
+		
+	def getLineAddress( self, line_number ):
+		return self.geometry.lineAddress( line_number )
+
+	# Display text at line directly
+	def displayLine( self, line, text ):
+		self.setLine( line, text )
+		self.display( line, text )
+		
+	# Display text at line directly
+	def display( self, line, text ):
+		if line > 0 and line <= self.display_lines:
+			self.displayEncoded( line, self.encode( text, line ).ljust( self.width )[ :self.width ] )
+
+	# Display LCD character codes at line, only the cells that changed
+	# since the last call are sent
+	def displayEncoded( self, line, data ):
+		self.uploadGlyphs()
+		line_address = self.getLineAddress( line ) & ~LCD_SETDDRAMADDR
+		for address, run in self.framebuffer.update( line_address, data ):
+			self.transport.data( run, LCD_SETDDRAMADDR | address )
+			lcd_metrics.CELLS_WRITTEN.inc( len( run ) )
+
+	# Write the glyphs that got a new CGRAM slot, before any text that
+	# uses them
+	def uploadGlyphs( self ):
+		for slot, pattern in self.glyphs.takeUploads():
+			self.transport.data( bytes( pattern ), LCD_SETCGRAMADDR | ( slot << 3 ) )
+
+	# Encode text for line (None: no particular line) to the LCD character
+	# codes of the ROM. pending: encoded texts (bytes) of the other lines
+	# that are still to be shown.
+	def encode( self, text, line=None, pending=() ):
+		if self.raw_mode:
+			return text.encode( 'latin-1', 'replace' )
+		if self.custom_glyphs:
+			# glyphs on the other lines must stay in CGRAM
+			keep = self.shownSlots( line ).union( *pending )
+			text = self.glyphs.substitute( text, keep,
+				romCharacters( self.character_rom, self.display_umlauts ) )
+		return encodeText( text, self.character_rom, self.display_umlauts )
+
+	# CGRAM slot codes on the display outside of line (None: anywhere)
+	def shownSlots( self, line=None ):
+		cells = self.framebuffer.cells
+		if line is not None:
+			start = self.geometry.row_offsets[ line - 1 ]
+			cells = cells[ :start ] + cells[ start + self.width: ]
+		return { code for code in cells if code is not None and code < CGRAM_SLOTS }
+		
+	# Set the display width
+	def setWidth(self,width):
+		self.geometry = self.geometry.withColumns( width )
+		self.framebuffer.invalidate()
+		return
+	
+	# Set backlight brightness from 0 (off) to 1 (full), the hardware is
+	# only touched when the level changes
+	def setBacklightLevel( self, level ):
+		level = min( max( level, 0.0 ), 1.0 )
+		if level == self.backlight:
+			return
+		self.transport.setBacklight( level )
+		self.backlight = level
+
+	# Enable/disable backlight
+	def setBacklightEnabled( self, enable_light ):
+		self.setBacklightLevel( 1.0 if enable_light else 0.0 )
+		return
+
+	# Enable backlight
+	def enableBacklight( self ):
+		self.setBacklightEnabled( True )
+		return
+	
+	# Disable backlight
+	def disableBacklight( self ):
+		self.setBacklightEnabled( False )
+		return
+	
+	# Send the display control flags if they changed
+	def setDisplayControl( self, flags ):
+		if flags == self.display_control:
+			return
+		self.transport.command( LCD_DISPLAYCONTROL | flags )
+		self.display_control = flags
+
+	# Switch the text display on or off (DDRAM contents are kept)
+	def setDisplayEnabled( self, enable ):
+		flags = self.display_control or 0
+		self.setDisplayControl( flags | LCD_DISPLAYON if enable else flags & ~LCD_DISPLAYON )
+
+	# Show/hide the underline cursor and the blinking block
+	def setCursor( self, visible, blink=False ):
+		flags = ( self.display_control or 0 ) & LCD_DISPLAYON
+		if visible:
+			flags |= LCD_CURSORON
+		if blink:
+			flags |= LCD_BLINKON
+		self.setDisplayControl( flags )
+
+	# Set raw mode on (No translation)
+	def setRawMode( self, value ):
+		self.raw_mode = value
+		return
+
+	# Use CGRAM glyphs for characters missing in the ROM
+	def setCustomGlyphs( self, value ):
+		self.custom_glyphs = value
+		return
+
+	# Set the character ROM of the controller, 'A00' or 'A02'
+	def setCharacterRom( self, rom ):
+		self.character_rom = rom
+		return
+
+	# Display umlats if tro elese oe ae etc
+	def displayUmlauts(self,value):
+		self.display_umlauts = value
+		return
+
+	# Translate special characters (umlautes etc) to LCD values
+	# See standard character patterns for LCD display. Only the former
+	# str based translation, encode uses the ROM codec.
+	def translateSpecialChars(self,sp):
+		return translate( sp, self.display_umlauts )
+
+
+class StoppableThread(threading.Thread):
+    """Thread class with a stop() method. The thread itself has to check
+    regularly for the stopped() condition."""
+
+    def __init__(self):
+        super(StoppableThread, self).__init__()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+class ScrollerUpdater( StoppableThread ):
+	# ctor
+	def __init__( self, lcd ):
+		super(ScrollerUpdater, self).__init__()
+		self.lcd = lcd
+		#self.scroll_thread.target = self.run
+		self.daemon = True  # thread dies when main thread (only non-daemon thread) exits.
+		
+	def stop( self ):
+		super( ScrollerUpdater, self ).stop()
+		self.lcd.state_changed.set()
+
+	# run: tick while something scrolls, otherwise sleep until the lines
+	# change. The event is cleared before rendering, so a change during
+	# the render wakes the next round right away.
+	def run( self ):
+		tick_clock = self.lcd.tick_clock
+		tick_clock.reset()
+		ticks = 1
+		while not self.stopped():
+			self.lcd.state_changed.clear()
+			self.lcd.updateScroll( ticks )
+			ticks = 1
+			if self.lcd.scroll_state.scrolling:
+				timeout, ticks = tick_clock.next( 1 / self.lcd.scroll_speed )
+				if not self.lcd.state_changed.wait( timeout ):
+					continue
+			else:
+				self.lcd.state_changed.wait()
+			# new lines start on a new grid
+			tick_clock.reset()
+			ticks = 1
+
+
+class ScrollingLCD( LCD ):	
+	# scroll speed
+	scroll_speed = 5
+	
+	# pause between scrolling left/right [in cycles]
+	scroll_pause = 5
+
+	# scroll lines of up to 40 characters with the display shift of the
+	# controller instead of rewriting them
+	hardware_scroll = False
+	
+	def __init__( self, transport, geometry=LCD_GEOMETRY ):
+		super( ScrollingLCD, self ).__init__( transport, geometry )
+		self.scroller_updater = ScrollerUpdater( self )
+
+		# Line state shared with the renderer. Writers build a new
+		# immutable ScrollState and swap it in, the renderer reads it once
+		# per tick, so it never sees a half updated set of lines.
+		self.state_lock = threading.RLock()
+		self.generations = itertools.count( 1 )
+		# set whenever a new state is published
+		self.state_changed = threading.Event()
+		self.updateFrames()
+
+		# deadlines of the scroll ticks
+		self.tick_clock = TickClock()
+
+		# scroll position of the renderer: key -> ( generation, index )
+		self.scroll_position = {}
+		
+	def startScrollThread( self ):
+		if not self.scroller_updater.is_alive():
+			self.scroller_updater.start()
+			
+	def stopScrollThread( self ):
+		self.scroller_updater.stop()
+		
+	# Set Scroll line speed (frequency of update) - Best values are 3-5 
+	# Limited to between 20 and 1
+	def setScrollSpeed( self, speed ):
+		speed = min( speed, 20 )
+		speed = max( speed, 1 )
+		self.scroll_speed = speed
+		return
+
+	# Set pause between scrolling left/right [in cycles]
+	def setScrollPause( self, pause ):
+		self.scroll_pause = max( pause, 0 )
+		self.updateFrames()
+		return
+
+	# Enable/disable hardware scrolling, lines that don't fit into the
+	# DDRAM or lines that must not move are still scrolled in software
+	def setHardwareScroll( self, enable ):
+		self.hardware_scroll = enable
+		self.updateFrames()
+		return
+
+	# Set text at line, a new text starts scrolling from the beginning
+	def setLine( self, line_number, text ):
+		if not 0 < line_number <= self.display_lines:
+			return
+		with self.state_lock:
+			if text == self.getLine( line_number ):
+				return
+			super( ScrollingLCD, self ).setLine( line_number, text )
+			self.updateFrames( line_number )
+
+	def setWidth( self, width ):
+		super( ScrollingLCD, self ).setWidth( width )
+		self.updateFrames()
+
+	def setRawMode( self, value ):
+		super( ScrollingLCD, self ).setRawMode( value )
+		self.updateFrames()
+
+	def displayUmlauts( self, value ):
+		super( ScrollingLCD, self ).displayUmlauts( value )
+		self.updateFrames()
+
+	def setCustomGlyphs( self, value ):
+		super( ScrollingLCD, self ).setCustomGlyphs( value )
+		self.updateFrames()
+
+	def setCharacterRom( self, rom ):
+		super( ScrollingLCD, self ).setCharacterRom( rom )
+		self.updateFrames()
+
+	# Precompute the scroll frames of one line (or all lines), restart
+	# scrolling of these lines and publish the new state
+	def updateFrames( self, line_number=None ):
+		with self.state_lock:
+			self.scroll_state = self.buildScrollState( line_number )
+		self.state_changed.set()
+
+	# Return a new ScrollState with the frames of line_number (or all
+	# lines) rebuilt, called with state_lock held
+	def buildScrollState( self, line_number=None ):
+		if line_number is None:
+			line_numbers = range( 1, len( self.lines ) + 1 )
+			lines = [ None ] * len( self.lines )
+		else:
+			line_numbers = [ line_number ]
+			lines = list( self.scroll_state.lines )
+		for line_number in line_numbers:
+			pending = [ line.data for line_index, line in enumerate( lines )
+				if line is not None and line_index != line_number - 1 ]
+			data = self.encode( self.getLine( line_number ), line_number, pending )
+			frames = scrollFrames( data, self.width, self.scroll_pause )
+			lines[ line_number - 1 ] = LineFrames( next( self.generations ), data, tuple( frames ) )
+
+		# the display shift moves all lines, so any change restarts it
+		hardware = None
+		data = [ line.data for line in lines ]
+		ddram_length = self.geometry.ddram_length
+		if self.hardware_scroll and self.geometry.can_shift:
+			offsets = hardwareScrollOffsets( data, self.width, self.scroll_pause, ddram_length )
+			if offsets is not None:
+				hardware = HardwareFrames( next( self.generations ), tuple( offsets ),
+					tuple( ( line_index + 1, line.ljust( ddram_length ) ) for line_index, line in enumerate( data ) ) )
+
+		scrolling = hardware is not None or any( len( line.frames ) > 1 for line in lines )
+		return ScrollState( tuple( lines ), hardware, scrolling )
+			
+	# Called from ScrollerUpdater, ticks > 1 skips the frames of missed ticks
+	def updateScroll( self, ticks=1 ):
+		self.renderFrame( self.nextFrame( ticks ) )
+
+	# Write a frame from nextFrame to the display
+	def renderFrame( self, frame ):
+		start = time.monotonic()
+		lines, shift = frame
+		self.setDisplayShift( shift )
+		for line, data in lines:
+			self.displayEncoded( line, data )
+		lcd_metrics.FRAMES_RENDERED.inc()
+		lcd_metrics.FRAME_BUS_SECONDS.observe( time.monotonic() - start )
+
+	# Advance the scroll state by one tick and return the frame to show as
+	# ( lines, shift ): the character codes of each line as a list of
+	# ( line, bytes ) tuples and the display shift. Does not touch the display.
+	def nextFrame( self, ticks=1 ):
+		state = self.scroll_state
+		if state.hardware is not None:
+			hardware = state.hardware
+			index = self.nextIndex( 'hardware', hardware.generation, len( hardware.offsets ), ticks )
+			return ( hardware.lines, hardware.offsets[ index ] )
+
+		frame = []
+		for line_index in range( self.display_lines ):
+			line = state.lines[ line_index ]
+			index = self.nextIndex( line_index, line.generation, len( line.frames ), ticks )
+			frame.append( ( line_index + 1, line.frames[ index ] ) )
+		return ( frame, 0 )
+
+	# Return the frame index for this tick, starting over for a new generation
+	def nextIndex( self, key, generation, length, ticks=1 ):
+		last_generation, index = self.scroll_position.get( key, ( None, 0 ) )
+		if last_generation != generation:
+			index = 0
+		elif index > 0:
+			# skip the frames of missed ticks
+			index += ticks - 1
+		self.scroll_position[ key ] = ( generation, index + 1 )
+		return index % length
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+# Shadow copy of the HD44780 display data RAM (DDRAM)
+#
+# Remembers which character code is currently stored in each DDRAM cell so
+# that the display classes only send the cells that actually changed.
+#
+
+# Size of the DDRAM address space (0x00 - 0x7F)
+DDRAM_SIZE = 0x80
+
+# An address command costs as much bus time as one character, so unchanged
+# gaps up to this length are rewritten instead of starting a new run
+MAX_GAP = 1
+
+class Framebuffer:
+	"""Shadow DDRAM of a HD44780 display, indexed by DDRAM address."""
+
+	def __init__( self ):
+		self.invalidate()
+
+	# Forget the display contents, the next update rewrites every cell
+	def invalidate( self ):
+		self.cells = [ None ] * DDRAM_SIZE
+
+	# Display has been cleared: every cell holds a space
+	def clear( self ):
+		self.cells = [ 0x20 ] * DDRAM_SIZE
+
+	# Store the character codes (bytes) of text at address and return the
+	# changed runs as a list of ( address, bytes ) tuples, one DDRAM
+	# address command per run
+	def update( self, address, text ):
+		runs = []
+		start = None
+		gap = 0
+		for i in range( len(text) ):
+			cell = address + i
+			if cell >= DDRAM_SIZE:
+				break
+			if self.cells[ cell ] == text[ i ]:
+				gap += 1
+				continue
+			if start is None or gap > MAX_GAP:
+				if start is not None:
+					runs.append( ( address + start, text[ start:end ] ) )
+				start = i
+			end = i + 1
+			gap = 0
+			self.cells[ cell ] = text[ i ]
+		if start is not None:
+			runs.append( ( address + start, text[ start:end ] ) )
+		return runs
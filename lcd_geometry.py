@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# Geometry of HD44780 modules
+#
+# The controller has 80 cells of DDRAM. In 2-line mode they are two rows
+# of 40 cells at 0x00 and 0x40; a 4-row module shows the second half of
+# each row as rows 3 and 4, a 1-row module uses 1-line mode with all 80
+# cells in one row. Everything that depends on the module (the function
+# set, the address of each row, which rows exist, how far the display
+# shift can scroll) comes from its Geometry.
+#
+
+from collections import namedtuple
+
+from i2c_lcd_driver import LCD_SETDDRAMADDR
+
+class Geometry( namedtuple( 'Geometry', 'columns rows row_offsets' ) ):
+	"""Visible columns and rows and the DDRAM offset of each row."""
+
+	__slots__ = ()
+
+	# Controller in 2-line mode (all but 1-row modules)
+	@property
+	def two_line( self ):
+		return self.rows > 1
+
+	# DDRAM cells of one controller line, the display shift wraps there
+	@property
+	def ddram_length( self ):
+		return 40 if self.two_line else 80
+
+	# Rows 3 and 4 are the second half of rows 1 and 2, so the display
+	# shift would move them into rows 1 and 2
+	@property
+	def can_shift( self ):
+		return self.rows <= 2
+
+	# Set DDRAM address instruction of row (1-based)
+	def lineAddress( self, row ):
+		return LCD_SETDDRAMADDR | self.row_offsets[ row - 1 ]
+
+	def withColumns( self, columns ):
+		return self._replace( columns=columns )
+
+# Standard DDRAM offsets for a module of rows x columns
+def rowOffsets( columns, rows ):
+	if rows == 1:
+		return ( 0x00, )
+	if rows == 2:
+		return ( 0x00, 0x40 )
+	return ( 0x00, 0x40, columns, 0x40 + columns )
+
+# Geometry from 'COLUMNSxROWS', e.g. '20x4'. 4-row modules wider than 20
+# columns (40x4) don't fit into the DDRAM of one controller.
+def parseGeometry( spec ):
+	columns, rows = ( int( value ) for value in spec.lower().split( 'x' ) )
+	if rows not in ( 1, 2, 4 ) or columns < 1 or columns * min( rows, 2 ) > 80 \
+			or ( rows == 4 and columns > 20 ):
+		raise ValueError( "Unsupported display geometry '{}'".format( spec ) )
+	return Geometry( columns, rows, rowOffsets( columns, rows ) )
+
+# Common modules
+GEOMETRY_16X2 = parseGeometry( '16x2' )
+GEOMETRY_20X4 = parseGeometry( '20x4' )
+GEOMETRY_40X2 = parseGeometry( '40x2' )
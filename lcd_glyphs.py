@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Custom characters in the HD44780 character generator RAM (CGRAM)
+#
+# The ROM lacks most accented capitals and vowels, encodeText (see
+# lcd_charmap) replaces them by their FALLBACKS or their NFKD base letter
+# ("Ae", "e"). The 8 CGRAM slots can hold any 5x8 glyph: GlyphManager
+# assigns the characters a text needs to slots, evicts the least recently
+# used slot when all are taken and queues a glyph for upload only when its
+# slot gets a new character.
+#
+
+import threading
+from collections import OrderedDict
+
+# Number of 5x8 glyphs in CGRAM, shown by character codes 0-7
+CGRAM_SLOTS = 8
+
+# 5x8 patterns, one row per byte from the top, lowest 5 bits are the pixels
+GLYPHS = {
+	'Ä': ( 0b01010, 0b00000, 0b01110, 0b10001, 0b11111, 0b10001, 0b10001, 0 ),
+	'Ö': ( 0b01010, 0b00000, 0b01110, 0b10001, 0b10001, 0b10001, 0b01110, 0 ),
+	'Ü': ( 0b01010, 0b00000, 0b10001, 0b10001, 0b10001, 0b10001, 0b01110, 0 ),
+	'É': ( 0b00010, 0b00100, 0b11111, 0b10000, 0b11110, 0b10000, 0b11111, 0 ),
+	'à': ( 0b01000, 0b00100, 0b01110, 0b00001, 0b01111, 0b10001, 0b01111, 0 ),
+	'á': ( 0b00010, 0b00100, 0b01110, 0b00001, 0b01111, 0b10001, 0b01111, 0 ),
+	'â': ( 0b00100, 0b01010, 0b01110, 0b00001, 0b01111, 0b10001, 0b01111, 0 ),
+	'ç': ( 0b00000, 0b00000, 0b01110, 0b10000, 0b10001, 0b01110, 0b00100, 0b01100 ),
+	'è': ( 0b01000, 0b00100, 0b01110, 0b10001, 0b11111, 0b10000, 0b01110, 0 ),
+	'é': ( 0b00010, 0b00100, 0b01110, 0b10001, 0b11111, 0b10000, 0b01110, 0 ),
+	'ê': ( 0b00100, 0b01010, 0b01110, 0b10001, 0b11111, 0b10000, 0b01110, 0 ),
+	'í': ( 0b00010, 0b00100, 0b00000, 0b01100, 0b00100, 0b00100, 0b01110, 0 ),
+	'ó': ( 0b00010, 0b00100, 0b00000, 0b01110, 0b10001, 0b10001, 0b01110, 0 ),
+	'ô': ( 0b00100, 0b01010, 0b00000, 0b01110, 0b10001, 0b10001, 0b01110, 0 ),
+	'ú': ( 0b00010, 0b00100, 0b00000, 0b10001, 0b10001, 0b10011, 0b01101, 0 ),
+}
+
+class GlyphManager:
+	"""Assigns custom glyphs to the CGRAM slots, least recently used first out."""
+
+	def __init__( self, glyphs=GLYPHS, slots=CGRAM_SLOTS ):
+		self.glyphs = glyphs
+		# character -> slot, least recently used first
+		self.slots = OrderedDict()
+		self.free = list( range( slots ) )
+		# slot -> pattern still to be written to CGRAM
+		self.pending = {}
+		# substitute runs on the writer thread, takeUploads on the render thread
+		self.lock = threading.Lock()
+
+	# Replace the glyph characters of text by their slot codes. The slots
+	# in keep_slots (codes shown elsewhere on the display) are never
+	# evicted, characters in rom are left alone, as are characters that
+	# find no slot (they are left for the ROM translation).
+	def substitute( self, text, keep_slots=frozenset(), rom=frozenset() ):
+		if text.isascii():
+			return text
+		needed = [ char for char in dict.fromkeys( text ) if char in self.glyphs and char not in rom ]
+		if not needed:
+			return text
+		table = {}
+		with self.lock:
+			keep = set( needed ).union( char for char, slot in self.slots.items() if slot in keep_slots )
+			for char in needed:
+				slot = self.slotFor( char, keep )
+				if slot is not None:
+					table[ ord( char ) ] = chr( slot )
+		return text.translate( table )
+
+	# Return the slot of char, loading it into a free or the least recently
+	# used slot if needed. None if all slots hold characters to keep.
+	def slotFor( self, char, keep ):
+		if char in self.slots:
+			self.slots.move_to_end( char )
+			return self.slots[ char ]
+		if self.free:
+			slot = self.free.pop( 0 )
+		else:
+			victim = next( ( loaded for loaded in self.slots if loaded not in keep ), None )
+			if victim is None:
+				return None
+			slot = self.slots.pop( victim )
+		self.slots[ char ] = slot
+		self.pending[ slot ] = self.glyphs[ char ]
+		return slot
+
+	# Return the ( slot, pattern ) uploads queued since the last call
+	def takeUploads( self ):
+		if not self.pending:
+			return []
+		with self.lock:
+			pending, self.pending = self.pending, {}
+		return sorted( pending.items() )
+
+	# CGRAM contents are lost (power up), upload every loaded glyph again
+	def reload( self ):
+		with self.lock:
+			self.pending = { slot: self.glyphs[ char ] for char, slot in self.slots.items() }
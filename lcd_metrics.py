@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Runtime metrics of the display and the MPD connection
+#
+# Counters and histograms are always collected. They are updated from the
+# display thread, the bus thread and the event loop, so every metric keeps
+# its additions under a lock of its own. The daemon writes them in the
+# Prometheus text format to METRICS_FILE, to be picked up by the textfile
+# collector of the node exporter.
+#
+
+import os
+import bisect
+import threading
+
+# Latency buckets [s]
+LATENCY_BUCKETS = ( 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5 )
+
+class Counter:
+	"""Monotonically increasing value."""
+
+	kind = 'counter'
+
+	def __init__( self, name, help ):
+		self.name = name
+		self.help = help
+		self.value = 0
+		# incremented from several threads (display thread, bus thread and event loop)
+		self.lock = threading.Lock()
+
+	def inc( self, amount=1 ):
+		with self.lock:
+			self.value += amount
+
+	def samples( self ):
+		with self.lock:
+			value = self.value
+		return [ ( self.name, '', value ) ]
+
+class Histogram:
+	"""Distribution of observed values in cumulative buckets."""
+
+	kind = 'histogram'
+
+	def __init__( self, name, help, buckets=LATENCY_BUCKETS ):
+		self.name = name
+		self.help = help
+		self.buckets = tuple( buckets )
+		# observations per bucket, the last one is +Inf
+		self.counts = [ 0 ] * ( len( self.buckets ) + 1 )
+		self.sum = 0.0
+		self.count = 0
+		# observed from several threads (display thread and event loop)
+		self.lock = threading.Lock()
+
+	def observe( self, value ):
+		with self.lock:
+			self.counts[ bisect.bisect_left( self.buckets, value ) ] += 1
+			self.sum += value
+			self.count += 1
+
+	def samples( self ):
+		with self.lock:
+			counts = list( self.counts )
+			total, count = self.sum, self.count
+		samples = []
+		cumulative = 0
+		for bound, bucket_count in zip( self.buckets + ( float( 'inf' ), ), counts ):
+			cumulative += bucket_count
+			le = '+Inf' if bound == float( 'inf' ) else repr( bound )
+			samples.append( ( self.name + '_bucket', '{le="' + le + '"}', cumulative ) )
+		samples.append( ( self.name + '_sum', '', total ) )
+		samples.append( ( self.name + '_count', '', count ) )
+		return samples
+
+class Registry:
+	"""Named metrics in the order they were created."""
+
+	def __init__( self ):
+		self.metrics = []
+
+	def counter( self, name, help ):
+		return self.add( Counter( name, help ) )
+
+	def histogram( self, name, help, buckets=LATENCY_BUCKETS ):
+		return self.add( Histogram( name, help, buckets ) )
+
+	def add( self, metric ):
+		self.metrics.append( metric )
+		return metric
+
+	# All metrics in the Prometheus text exposition format
+	def exposition( self ):
+		lines = []
+		for metric in self.metrics:
+			lines.append( '# HELP {} {}'.format( metric.name, metric.help ) )
+			lines.append( '# TYPE {} {}'.format( metric.name, metric.kind ) )
+			for name, labels, value in metric.samples():
+				lines.append( '{}{} {}'.format( name, labels, value ) )
+		return '\n'.join( lines ) + '\n'
+
+	# Replace path with the current values, atomically so the collector
+	# never reads a partial file
+	def writeTextfile( self, path ):
+		temporary = path + '.tmp'
+		with open( temporary, 'w' ) as f:
+			f.write( self.exposition() )
+		os.replace( temporary, path )
+
+METRICS = Registry()
+
+FRAMES_RENDERED = METRICS.counter( 'lcd_frames_rendered_total', 'Scroll frames written to the display' )
+CELLS_WRITTEN = METRICS.counter( 'lcd_cells_written_total', 'Character cells sent to the display' )
+I2C_TRANSACTIONS = METRICS.counter( 'lcd_i2c_transactions_total', 'I2C transactions to the display' )
+DEADLINE_MISSES = METRICS.counter( 'lcd_scroll_deadline_misses_total', 'Scroll ticks skipped because rendering was late' )
+FRAME_BUS_SECONDS = METRICS.histogram( 'lcd_frame_bus_seconds', 'Time spent on the bus per scroll frame' )
+MPD_ROUND_TRIP_SECONDS = METRICS.histogram( 'lcd_mpd_round_trip_seconds', 'Time to fetch status and current song from mpd' )
+SONG_CHANGE_SECONDS = METRICS.histogram( 'lcd_song_change_display_seconds', 'Time from a player event to the new song on the display' )
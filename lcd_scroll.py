@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# Precomputed scroll frames for the ScrollingLCD classes
+#
+# A line that is longer than the display is scrolled in four phases:
+# pause - scroll right - pause - scroll left. The whole sequence is built
+# once when the line is set, every tick then only picks the next frame.
+#
+
+from collections import namedtuple
+from time import monotonic
+
+import lcd_metrics
+
+# Immutable scroll state published by ScrollingLCD: the frames of every
+# line, the hardware scroll sequence (or None) and whether any line that
+# is shown has more than one frame
+ScrollState = namedtuple( 'ScrollState', 'lines hardware scrolling' )
+
+# Encoded text and frames of one line, generation changes with the text
+LineFrames = namedtuple( 'LineFrames', 'generation data frames' )
+
+# Display shift per tick and the ( line, bytes ) DDRAM contents
+HardwareFrames = namedtuple( 'HardwareFrames', 'generation offsets lines' )
+
+# Number of DDRAM cells of one line of a 2-line display
+DDRAM_LINE_LENGTH = 40
+
+# Return the start offset of the visible window for every scroll tick
+def scrollOffsets( length, width, pause ):
+	len_diff = length - width
+	if len_diff <= 0:
+		return [ 0 ]
+
+	# the former state machine spent one more tick at the end of every
+	# phase to switch to the next one, the extra ticks keep its timing:
+	# pause + 1 ticks at the start, pause + 3 at every later stop
+	offsets = [ 0 ] * ( pause + 1 )				# Start pause
+	offsets += range( 1, len_diff + 1 )			# Scroll right
+	offsets += [ len_diff ] * ( pause + 2 )			# End pause
+	offsets += range( len_diff - 1, -1, -1 )		# Scroll left
+	offsets += [ 0 ]
+	return offsets
+
+# Return the frames for one line as a list of LCD character codes
+# (bytes of exactly width length), one frame per scroll tick
+def scrollFrames( data, width, pause ):
+	data = data.ljust( width )
+	windows = [ data[ offset:offset + width ] for offset in range( len( data ) - width + 1 ) ]
+	return [ windows[ offset ] for offset in scrollOffsets( len( data ), width, pause ) ]
+
+# Return the display shift for every scroll tick if the lines can be
+# scrolled by the controller itself, None otherwise.
+#
+# The display shift command moves all lines at once, so this only works
+# if every line that is shown is too long for the display, and no line
+# is longer than its DDRAM (ddram_length cells).
+def hardwareScrollOffsets( lines, width, pause, ddram_length=DDRAM_LINE_LENGTH ):
+	lines = [ data for data in lines if len( data ) > 0 ]
+	if not lines:
+		return None
+	for data in lines:
+		if len( data ) <= width or len( data ) > ddram_length:
+			return None
+	return scrollOffsets( max( len( data ) for data in lines ), width, pause )
+
+# Deadline based tick timing for the scroller.
+#
+# Ticks are scheduled on a fixed grid of the monotonic clock, so the time
+# spent rendering does not add to the period. If a render overruns one or
+# more deadlines those ticks are skipped (the next frame advances by
+# several ticks) instead of the scroller falling further behind.
+class TickClock:
+
+	# deadlines missed since the clock was created
+	missed = 0
+
+	def __init__( self ):
+		self.deadline = None
+
+	# Start a new grid now, call this right before rendering the first frame
+	def reset( self ):
+		self.deadline = monotonic()
+
+	# Schedule the next tick and return ( timeout, ticks ): the seconds to
+	# wait for it and the number of ticks the next frame has to advance
+	def next( self, period ):
+		now = monotonic()
+		if self.deadline is None:
+			self.deadline = now + period
+			return ( period, 1 )
+		self.deadline += period
+		ticks = 1
+		if self.deadline <= now:
+			skipped = int( ( now - self.deadline ) // period ) + 1
+			self.missed += skipped
+			lcd_metrics.DEADLINE_MISSES.inc( skipped )
+			self.deadline += skipped * period
+			ticks += skipped
+		return ( self.deadline - now, ticks )
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Transports between the display classes in lcd_core and the hardware
+#
+# A transport sends HD44780 instructions and character data and switches
+# the backlight. The hardware modules (RPi.GPIO, smbus) are only imported
+# when a transport that needs them is created.
+#
+
+# Interface of all transports
+class Transport:
+	# setBacklight can show levels between 0 and 1
+	can_dim = False
+
+	# Set up the hardware and the controller (display on, cleared), in
+	# 2-line mode unless two_line is False
+	def initialize( self, two_line=True ):
+		raise NotImplementedError
+
+	# Send an instruction
+	def command( self, value ):
+		raise NotImplementedError
+
+	# Send a run of character codes (bytes), preceded by the address
+	# instruction if one is given
+	def data( self, codes, address=None ):
+		raise NotImplementedError
+
+	# Wait for a slow instruction (clear, home) to finish
+	def wait( self, seconds ):
+		raise NotImplementedError
+
+	# Set the backlight brightness from 0 (off) to 1 (full), transports
+	# that cannot dim switch it on for any level above 0
+	def setBacklight( self, level ):
+		raise NotImplementedError
+
+
+# Transport without hardware, records everything it is asked to send
+class TestTransport( Transport ):
+	can_dim = True
+
+	def __init__( self ):
+		self.initialized = False
+		self.backlight = None
+		self.sent = []
+
+	def initialize( self, two_line=True ):
+		self.initialized = True
+
+	def command( self, value ):
+		self.sent.append( ( 'command', value ) )
+
+	def data( self, codes, address=None ):
+		if address is not None:
+			self.command( address )
+		self.sent.append( ( 'data', bytes( codes ) ) )
+
+	def wait( self, seconds ):
+		return
+
+	def setBacklight( self, level ):
+		self.backlight = level
+		self.sent.append( ( 'backlight', level ) )
+
+
+# Create a transport by name: 'gpio', 'i2c' or 'test'
+def createTransport( name, **options ):
+	if name == 'gpio':
+		from lcd_class import GPIOTransport
+		return GPIOTransport( **options )
+	if name == 'i2c':
+		from lcd_i2c_class import I2CTransport
+		return I2CTransport( **options )
+	if name == 'test':
+		return TestTransport( **options )
+	raise ValueError( "Unknown display transport '{}'".format( name ) )
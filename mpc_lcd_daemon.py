@@ -8,98 +8,219 @@ import signal
 import time
 import string
 import datetime
-
-from mpd import MPDClient
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 # Class imports
 from daemon3_class import Daemon
-#from lcd_class    import ScrollingLCD
-from lcd_i2c_class import ScrollingLCD
-
-lcd = ScrollingLCD()
-mpc = MPDClient()
+from lcd_core import ScrollingLCD
+from lcd_transport import createTransport
+from lcd_geometry import parseGeometry
+from mpd_session import MPDSession
+from lcd_api import APIServer, DisplayRegions
+from song_metadata import SongMetadata
+import lcd_metrics
+import bus_trace
+
+# Display wiring: 'i2c' (PCF8574 backpack) or 'gpio' (parallel, see lcd_class)
+LCD_TRANSPORT = 'i2c'
+
+# Display module, columns x rows: '16x2', '20x4', '40x2', ...
+LCD_GEOMETRY = '16x2'
+
+# Backlight level while playing and while paused (stopped: off). Dimming
+# needs the GPIO wiring, the I2C backpack can only switch it on and off,
+# so it stays off while paused.
+BACKLIGHT_PLAYING = 1.0
+BACKLIGHT_PAUSED = 0.3
+
+# Prometheus textfile for the metrics (see lcd_metrics), None to disable,
+# and how often it is rewritten [s]
+METRICS_FILE = None
+#METRICS_FILE = '/var/lib/prometheus/node-exporter/lcd_mpc.prom'
+METRICS_INTERVAL = 15
+
+# Ring buffer file for the bus trace (see bus_trace), None to disable
+BUS_TRACE_FILE = None
+#BUS_TRACE_FILE = '/run/lcd-mpc.trace'
+
+# Unix socket for line updates and overlays from other services (see
+# lcd_api), None to disable
+API_SOCKET = None
+#API_SOCKET = '/run/lcd-mpc.sock'
+
+lcd = ScrollingLCD( createTransport( LCD_TRANSPORT ), parseGeometry( LCD_GEOMETRY ) )
 
 # LCD-MPC Daemon
+#
+# MPD notifications, scroll ticks and display updates all run as tasks on
+# one asyncio event loop. The loop owns the line and scroll state, the
+# display calls run one at a time on a display thread so a slow display
+# never blocks the loop and never sees two writers at once. Each transport
+# operation of such a call is a job of its own on the bus (see
+# bus_scheduler), so other displays on the bus get their turn in between.
 class LCDMPCDaemon( Daemon ):
 
 	terminate_now = False
 
 	def __init__( self, pidfile ):
-		super(Daemon, self).__init__()
-		signal.signal( signal.SIGINT, self.exitGracefully )
-		signal.signal( signal.SIGTERM, self.exitGracefully )
+		super( LCDMPCDaemon, self ).__init__( pidfile )
 
 	def exitGracefully( self ):
 		self.terminate_now = True
+		self.stopped.set()
 
-	def __del__( self ):
-		print("Stopping daemon")
-		lcd.stopScrollThread()
-		lcd.displayLine( 1, 'LCD-Daemon off')
-		lcd.displayLine( 2, '')
-		lcd.disableBacklight()
-		time.sleep(3)
-		lcd.clear()
-
-	def connectMPD( self ):
-		connected = False
-		try_again_time = 1
-		try_again_time_max = 6
-		while not connected:
-			if self.terminate_now:
-				break;
-			try:
-				mpc.connect( "localhost", 6600 )
-				connected = True
-				print("Successfully connected to mpd")
-			except:
-				print("Couldn't connect to mpd, trying again in {}s".format(try_again_time))
-				time.sleep( try_again_time )
-				try_again_time = min( try_again_time * 1.5, try_again_time_max )
+	# Run a display function on the display thread
+	def onDisplay( self, function, *args ):
+		return asyncio.get_running_loop().run_in_executor( self.display, function, *args )
 
 	def run(self):
-		# Initialize lcd and mpc
-		lcd.initialize()
-		lcd.disableBacklight()
-		lcd.setScrollSpeed( 5 )
-		lcd.displayLine( 1, 'LCD-Daemon on')
-		lcd.displayLine( 2, '')
-		
-		self.connectMPD()
-		lcd.startScrollThread()
-
-		# Main processing loop
-		while True:
-			if self.terminate_now:
-				break
-			songinfo = self.getCurrentSongInfo()
-			print("[isPlaying: {}] {}: {}".format(self.isPlaying(), songinfo['artist'], songinfo['title']))
-			lcd.setBacklightEnabled( self.isPlaying() )
-			lcd.setLine( 1, songinfo['artist'] )
-			#lcd.setLine( 1, 'Buena Vista Social Club' )
-			lcd.setLine( 2, songinfo['title'] )
-			time.sleep( 1 )
+		asyncio.run( self.main() )
 
-	def isPlaying(self):
-		return mpc.status()['state'] == 'play'
+	async def main( self ):
+		loop = asyncio.get_running_loop()
+		self.stopped = asyncio.Event()
+		self.lines_changed = asyncio.Event()
+		for signal_number in ( signal.SIGINT, signal.SIGTERM ):
+			loop.add_signal_handler( signal_number, self.exitGracefully )
 
-	def getCurrentSongInfo(self):
-		info = mpc.currentsong()
-		ret_info = dict(artist='Unknown', title='Unknown')
+		# all display access goes through one thread
+		self.display = ThreadPoolExecutor( max_workers=1, thread_name_prefix='display' )
+		if BUS_TRACE_FILE:
+			bus_trace.start( BUS_TRACE_FILE )
 
-		if not ( 'artist' in info or 'title' in info ):
-			return ret_info
+		# Initialize lcd and mpc
+		await self.onDisplay( lcd.initialize )
+		await self.onDisplay( lcd.disableBacklight )
+		lcd.setScrollSpeed( 5 )
+		await self.onDisplay( lcd.displayLine, 1, 'LCD-Daemon on')
+		await self.onDisplay( lcd.displayLine, 2, '')
+
+		# connects in the background, the display keeps the last song
+		# while mpd is away
+		self.session = MPDSession()
+		self.song_change_time = None
+		self.metadata = SongMetadata()
+		self.songinfo = None
+		self.regions = DisplayRegions( lcd.display_lines )
+		self.overlay_expiry = None
+		api = None
+		if API_SOCKET:
+			api = APIServer( self.regions, self.showRegions, API_SOCKET )
+			await api.start()
+		tasks = [ asyncio.ensure_future( self.watchPlayer() ),
+			asyncio.ensure_future( self.scrollDisplay() ) ]
+		if METRICS_FILE:
+			tasks.append( asyncio.ensure_future( self.writeMetrics() ) )
+		await self.stopped.wait()
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather( *tasks, return_exceptions=True )
+		if api is not None:
+			await api.stop()
+		if self.overlay_expiry is not None:
+			self.overlay_expiry.cancel()
+
+		self.session.disconnect()
+		await self.shutdownDisplay()
+		self.display.shutdown()
+		bus_trace.stop()
+		if METRICS_FILE:
+			# the last interval would be lost otherwise
+			self.writeMetricsFile()
+
+	async def shutdownDisplay( self ):
+		print("Stopping daemon")
+		if lcd.tick_clock.missed:
+			print("Scrolling missed {} deadlines".format( lcd.tick_clock.missed ))
+		await self.onDisplay( lcd.displayLine, 1, 'LCD-Daemon off')
+		await self.onDisplay( lcd.displayLine, 2, '')
+		await self.onDisplay( lcd.disableBacklight )
+		await asyncio.sleep(3)
+		await self.onDisplay( lcd.clear )
+
+	# Refresh whenever mpd reports a player event (play, pause, stop, new song)
+	async def watchPlayer( self ):
+		await self.session.watch( [ 'player' ], self.updateSongInfo )
+
+	# Show player state and current song
+	async def updateSongInfo( self, status, song ):
+		state = status['state']
+		playing = state == 'play'
+		songinfo = self.metadata.info( song )
+		print("[isPlaying: {}] {}: {}".format(playing, songinfo.artist, songinfo.title))
+		# play/pause of the same song only changes the backlight
+		if songinfo != self.songinfo:
+			self.songinfo = songinfo
+			self.song_change_time = self.session.event_time
+			self.regions.setBase( 1, songinfo.artist )
+			#self.regions.setBase( 1, 'Buena Vista Social Club' )
+			self.regions.setBase( 2, songinfo.title )
+			self.showRegions()
+		await self.onDisplay( lcd.setBacklightLevel, self.backlightLevel( state ) )
+
+	# Put the wanted text of every line (song, API lines and overlays) on
+	# the display and come back when the next overlay ends. Only sets the
+	# lines, scrollDisplay renders the latest state once.
+	def showRegions( self ):
+		loop = asyncio.get_running_loop()
+		for line, text in enumerate( self.regions.compose( loop.time() ), 1 ):
+			lcd.setLine( line, text )
+		self.lines_changed.set()
+
+		if self.overlay_expiry is not None:
+			self.overlay_expiry.cancel()
+			self.overlay_expiry = None
+		expiry = self.regions.nextExpiry()
+		if expiry is not None:
+			self.overlay_expiry = loop.call_at( expiry, self.showRegions )
+
+	# Advance the scroll state on the loop, write the frame on the display thread.
+	# Ticks only while a line scrolls, otherwise waits for new lines.
+	async def scrollDisplay( self ):
+		lcd.tick_clock.reset()
+		ticks = 1
+		while True:
+			self.lines_changed.clear()
+			song_change_time, self.song_change_time = self.song_change_time, None
+			frame = lcd.nextFrame( ticks )
+			await self.onDisplay( lcd.renderFrame, frame )
+			if song_change_time is not None:
+				lcd_metrics.SONG_CHANGE_SECONDS.observe( time.monotonic() - song_change_time )
+			ticks = 1
+			if lcd.scroll_state.scrolling:
+				timeout, ticks = lcd.tick_clock.next( 1 / lcd.scroll_speed )
+				try:
+					await asyncio.wait_for( self.lines_changed.wait(), timeout )
+				except asyncio.TimeoutError:
+					continue
+			else:
+				await self.lines_changed.wait()
+			# new lines start on a new grid
+			lcd.tick_clock.reset()
+			ticks = 1
+
+	# Rewrite the metrics textfile every METRICS_INTERVAL seconds
+	async def writeMetrics( self ):
+		while True:
+			self.writeMetricsFile()
+			await asyncio.sleep( METRICS_INTERVAL )
 
-		if 'artist' in info:
-			ret_info['artist'] = info['artist']
-			ret_info['title'] = info['title']
-		else:
-			title_sections = info['title'].split(' - ')
-			if len(title_sections) > 1:
-				ret_info['artist'] = title_sections[0]
-				ret_info['title'] = title_sections[1]
+	def writeMetricsFile( self ):
+		try:
+			lcd_metrics.METRICS.writeTextfile( METRICS_FILE )
+		except OSError as error:
+			print("Couldn't write metrics: {}".format(error))
 
-		return ret_info
+	def isPlaying(self):
+		return self.session.status.get( 'state' ) == 'play'
+
+	def backlightLevel( self, state ):
+		if state == 'play':
+			return BACKLIGHT_PLAYING
+		if state == 'pause' and lcd.transport.can_dim:
+			return BACKLIGHT_PAUSED
+		return 0.0
 
 
 def no_interrupt():
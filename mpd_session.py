@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Connection to the Music Player Daemon for the LCD daemon
+#
+# MPDSession owns the asyncio MPD client. It fetches the player status and
+# the current song in one round trip, waits for player events and, when
+# the connection drops, reconnects in the background with a jittered
+# backoff. Callers keep showing the last known state meanwhile.
+#
+
+import time
+import random
+import asyncio
+
+import lcd_metrics
+
+from mpd import ConnectionError as MPDConnectionError
+from mpd.asyncio import MPDClient
+
+# MPD server: host name or path of the Unix socket, the socket
+# (e.g. '/run/mpd/socket') saves the TCP round trip through localhost
+MPD_HOST = 'localhost'
+MPD_PORT = 6600
+
+# Reconnect delay [s]: starts at the minimum and grows by the factor up to
+# the maximum, each wait is randomized by +-RECONNECT_JITTER so that many
+# clients don't hit a restarted server at the same moment
+RECONNECT_MIN = 1
+RECONNECT_MAX = 30
+RECONNECT_FACTOR = 1.5
+RECONNECT_JITTER = 0.25
+
+# Errors that mean the connection is gone
+CONNECTION_ERRORS = ( MPDConnectionError, OSError, asyncio.TimeoutError )
+
+class MPDSession:
+
+	def __init__( self, host=MPD_HOST, port=MPD_PORT, client=None ):
+		self.host = host
+		self.port = port
+		self.client = client or MPDClient()
+		# last known player status and current song
+		self.status = {}
+		self.song = {}
+		self.event_time = None
+
+	# Connect, retrying until it works
+	async def connect( self ):
+		delay = RECONNECT_MIN
+		while True:
+			try:
+				await self.client.connect( self.host, self.port )
+				print("Successfully connected to mpd")
+				return
+			except CONNECTION_ERRORS:
+				wait = delay * random.uniform( 1 - RECONNECT_JITTER, 1 + RECONNECT_JITTER )
+				print("Couldn't connect to mpd, trying again in {:.1f}s".format(wait))
+				await asyncio.sleep( wait )
+				delay = min( delay * RECONNECT_FACTOR, RECONNECT_MAX )
+
+	def disconnect( self ):
+		try:
+			self.client.disconnect()
+		except CONNECTION_ERRORS:
+			pass
+
+	# Fetch status and current song. The asyncio client writes each
+	# command as soon as it is called, so both are sent before the first
+	# reply is read: one round trip, like a command list.
+	async def fetch( self ):
+		start = time.monotonic()
+		self.status, self.song = await asyncio.gather( self.client.status(), self.client.currentsong() )
+		lcd_metrics.MPD_ROUND_TRIP_SECONDS.observe( time.monotonic() - start )
+		return ( self.status, self.song )
+
+	# Call update( status, song ) now and after every change of one of the
+	# subsystems, reconnecting whenever the connection is lost. Runs until
+	# cancelled. event_time is the monotonic time of the event behind the
+	# current update.
+	async def watch( self, subsystems, update ):
+		while True:
+			await self.connect()
+			try:
+				self.event_time = time.monotonic()
+				await update( *await self.fetch() )
+				async for changed in self.client.idle( subsystems ):
+					self.event_time = time.monotonic()
+					await update( *await self.fetch() )
+			except CONNECTION_ERRORS as error:
+				print("Lost connection to mpd: {}".format(error))
+			self.disconnect()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Artist and title of the current song
+#
+# MPD reports files with tags and web radio with the station in 'name' and
+# the ICY stream title ("Artist - Title", sometimes with other dashes) in
+# 'title'. Tags can be missing or, when a file has several values, lists.
+# Songs are parsed once and kept in a small LRU keyed by MPD song id and
+# file; a stream keeps its id while the stream title changes, so the cached
+# result is only used while title and name are unchanged.
+#
+
+import os
+from collections import namedtuple, OrderedDict
+
+SongInfo = namedtuple( 'SongInfo', 'artist title' )
+
+UNKNOWN = 'Unknown'
+
+# Separators between artist and title in ICY stream titles
+ICY_SEPARATORS = ( ' - ', ' – ', ' — ', ' ~ ' )
+
+# Songs kept in the cache
+SONG_CACHE_SIZE = 32
+
+# Value of a tag as one string, '' when missing
+def tag( song, name ):
+	value = song.get( name, '' )
+	if isinstance( value, list ):
+		value = ', '.join( value )
+	return value.strip()
+
+# Split an ICY stream title into artist and title, artist is '' without
+# a separator
+def splitStreamTitle( text ):
+	for separator in ICY_SEPARATORS:
+		artist, found, title = text.partition( separator )
+		if found and artist.strip() and title.strip():
+			return artist.strip(), title.strip()
+	return '', text
+
+def parseSong( song ):
+	artist = tag( song, 'artist' ) or tag( song, 'albumartist' )
+	title = tag( song, 'title' )
+	if title and not artist:
+		artist, title = splitStreamTitle( title )
+	if not artist:
+		artist = tag( song, 'name' ) or UNKNOWN
+	if not title:
+		# a local file without tags shows its file name
+		path = tag( song, 'file' )
+		if path and '://' not in path:
+			title = os.path.splitext( os.path.basename( path ) )[ 0 ]
+	return SongInfo( artist, title or UNKNOWN )
+
+class SongMetadata:
+	"""LRU cache of parsed songs."""
+
+	def __init__( self, size=SONG_CACHE_SIZE ):
+		self.size = size
+		# ( id, file ) -> ( ( title, name ), SongInfo )
+		self.songs = OrderedDict()
+
+	# SongInfo of a currentsong() result
+	def info( self, song ):
+		key = ( song.get( 'id' ), song.get( 'file' ) )
+		stream = ( song.get( 'title' ), song.get( 'name' ) )
+		entry = self.songs.get( key )
+		if entry is not None and entry[ 0 ] == stream:
+			self.songs.move_to_end( key )
+			return entry[ 1 ]
+
+		info = parseSong( song )
+		self.songs[ key ] = ( stream, info )
+		self.songs.move_to_end( key )
+		if len( self.songs ) > self.size:
+			self.songs.popitem( last=False )
+		return info